@@ -1,26 +1,213 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, Query, Request, Response, UploadFile, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ReadPreference, ReturnDocument, UpdateOne, monitoring
+from gridfs.errors import NoFile
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError, ServerSelectionTimeoutError, WaitQueueTimeoutError
 import os
+import io
+import re
+import csv
+import json
+import codecs
+import base64
+import bisect
+import hashlib
+import heapq
 import logging
+import math
+import struct
+import tempfile
+import zlib
+import time
+import asyncio
+import contextvars
+import threading
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from urllib.parse import parse_qs
+from pydantic import BaseModel, Field, ValidationError
+from typing import Iterator, List, Optional
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import bcrypt
 import jwt
-from geojson import Point, Feature, FeatureCollection
+import numpy as np
+import orjson
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from prometheus_client import CONTENT_TYPE_LATEST, Counter as MetricCounter, Gauge, Histogram, generate_latest
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics
+# Collectors live in the default Prometheus registry and are served at /metrics
+request_latency = Histogram("http_request_duration_seconds", "Request latency by route", ["method", "route", "status"])
+requests_in_progress = Gauge("http_requests_in_progress", "Requests currently being served", ["method"])
+response_size = Histogram(
+    "http_response_size_bytes", "Response body size by route", ["method", "route"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+)
+mongo_command_latency = Histogram("mongo_command_duration_seconds", "MongoDB command latency", ["command", "collection"])
+mongo_command_failures = MetricCounter("mongo_command_failures_total", "Failed MongoDB commands", ["command", "collection"])
+mongo_documents_returned = MetricCounter("mongo_documents_returned_total", "Documents returned by cursor commands", ["collection"])
+stage_latency = Histogram("app_stage_duration_seconds", "Time spent in instrumented request stages", ["stage"])
+requests_rejected = MetricCounter("http_requests_rejected_total", "Requests refused by rate limiting or load shedding", ["reason", "cost"])
+
+# Requests slower than this are logged with the explain output of their slowest query; 0 disables
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', '0'))
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct"}
+
+# Per-request timings; Motor copies the context into its worker threads, so the command listener sees it too
+class RequestTimings:
+    def __init__(self):
+        self.mongo_seconds = 0.0
+        self.mongo_commands = 0
+        self.stages = Counter()
+        self.slowest_command = None
+    
+    def add_command(self, seconds: float, database: str, command: Optional[dict]):
+        self.mongo_seconds += seconds
+        self.mongo_commands += 1
+        if command and (self.slowest_command is None or seconds > self.slowest_command[0]):
+            self.slowest_command = (seconds, database, command)
+
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+@contextmanager
+def timed_stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        stage_latency.labels(name).observe(seconds)
+        timings = request_timings.get()
+        if timings:
+            timings.stages[name] += seconds
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self.pending = {}
+    
+    def started(self, event):
+        collection = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        command = event.command if event.command_name in EXPLAINABLE_COMMANDS and SLOW_REQUEST_SECONDS else None
+        self.pending[(event.connection_id, event.request_id)] = (
+            collection if isinstance(collection, str) else "-", event.database_name, command
+        )
+    
+    def succeeded(self, event):
+        collection = self.finish(event)
+        cursor = event.reply.get("cursor")
+        if isinstance(cursor, dict):
+            mongo_documents_returned.labels(collection).inc(len(cursor.get("firstBatch", cursor.get("nextBatch", []))))
+    
+    def failed(self, event):
+        collection = self.finish(event)
+        mongo_command_failures.labels(event.command_name, collection).inc()
+    
+    def finish(self, event) -> str:
+        collection, database, command = self.pending.pop((event.connection_id, event.request_id), ("-", None, None))
+        seconds = event.duration_micros / 1e6
+        mongo_command_latency.labels(event.command_name, collection).observe(seconds)
+        timings = request_timings.get()
+        if timings:
+            timings.add_command(seconds, database, command)
+        return collection
+
+mongo_pool_wait = Histogram(
+    "mongo_pool_wait_seconds", "Time spent waiting to check out a pooled connection", ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+mongo_pool_checkout_failures = MetricCounter("mongo_pool_checkout_failures_total", "Failed connection checkouts", ["pool", "reason"])
+mongo_pool_connections = Gauge("mongo_pool_connections", "Open pooled connections", ["pool"])
+mongo_pool_in_use = Gauge("mongo_pool_connections_in_use", "Checked out pooled connections", ["pool"])
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    # Checkouts happen synchronously on one Motor worker thread, so the start time is kept per thread
+    def __init__(self, pool: str):
+        self.pool = pool
+        self.checkout = threading.local()
+    
+    def connection_check_out_started(self, event):
+        self.checkout.started = time.perf_counter()
+    
+    def connection_checked_out(self, event):
+        mongo_pool_wait.labels(self.pool).observe(time.perf_counter() - getattr(self.checkout, "started", time.perf_counter()))
+        mongo_pool_in_use.labels(self.pool).inc()
+    
+    def connection_check_out_failed(self, event):
+        mongo_pool_wait.labels(self.pool).observe(time.perf_counter() - getattr(self.checkout, "started", time.perf_counter()))
+        mongo_pool_checkout_failures.labels(self.pool, event.reason).inc()
+    
+    def connection_checked_in(self, event):
+        mongo_pool_in_use.labels(self.pool).dec()
+    
+    def connection_created(self, event):
+        mongo_pool_connections.labels(self.pool).inc()
+    
+    def connection_closed(self, event):
+        mongo_pool_connections.labels(self.pool).dec()
+    
+    def pool_created(self, event):
+        pass
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        pass
+    
+    def pool_closed(self, event):
+        pass
+    
+    def connection_ready(self, event):
+        pass
+
 # MongoDB connection
+# A full pool makes requests wait at most MONGO_WAIT_QUEUE_TIMEOUT_MS and then fail with 503 instead of piling up
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+MONGO_POOL_OPTIONS = {
+    "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', '10')),
+    "waitQueueTimeoutMS": int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000')),
+    "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+    "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+    "socketTimeoutMS": int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '30000')),
+}
+client = AsyncIOMotorClient(
+    mongo_url, event_listeners=[MongoCommandMetrics(), MongoPoolMetrics("primary")], **MONGO_POOL_OPTIONS
+)
 db = client[os.environ['DB_NAME']]
+# Job uploads and results
+job_files = AsyncIOMotorGridFSBucket(db, bucket_name="job_files")
+
+# Heavy reads (analytics, export, geojson) get their own smaller pool, so long aggregations cannot starve
+# logins and CRUD of connections. Uncached reads such as exports prefer secondaries
+MONGO_ANALYTICS_POOL_OPTIONS = {
+    **MONGO_POOL_OPTIONS,
+    "maxPoolSize": int(os.environ.get('MONGO_ANALYTICS_MAX_POOL_SIZE', '20')),
+    "minPoolSize": int(os.environ.get('MONGO_ANALYTICS_MIN_POOL_SIZE', '2')),
+    "socketTimeoutMS": int(os.environ.get('MONGO_ANALYTICS_SOCKET_TIMEOUT_MS', '120000')),
+    "readPreference": os.environ.get('MONGO_ANALYTICS_READ_PREFERENCE', 'secondaryPreferred'),
+}
+analytics_client = AsyncIOMotorClient(
+    mongo_url, event_listeners=[MongoCommandMetrics(), MongoPoolMetrics("analytics")], **MONGO_ANALYTICS_POOL_OPTIONS
+)
+analytics_db = analytics_client[os.environ['DB_NAME']]
+# Responses cached under the collection version must be read from the primary: a lagging secondary's
+# pre-write result would otherwise be cached, and revalidated with 304s, until the next write
+analytics_primary_db = analytics_client.get_database(os.environ['DB_NAME'], read_preference=ReadPreference.PRIMARY)
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -30,8 +217,303 @@ api_router = APIRouter(prefix="/api")
 
 # Security
 security = HTTPBearer()
+# EventSource cannot set headers, so the change feed also accepts ?token=
+optional_security = HTTPBearer(auto_error=False)
 SECRET_KEY = "your-secret-key-here"
 
+# Password hashing runs in its own bounded pool so bursts of logins cannot block the event loop
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', '4'))
+BCRYPT_MAX_QUEUE = int(os.environ.get('BCRYPT_MAX_QUEUE', '64'))
+bcrypt_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+bcrypt_stats = {"in_flight": 0, "max_queued": 0, "rejected": 0}
+
+# Bulk import
+IMPORT_BATCH_SIZE = 1000
+IMPORT_READ_SIZE = 64 * 1024
+IMPORT_MAX_ERRORS = 1000
+IMPORT_FORMATS = ["geojson", "ndjson", "csv"]
+
+# Bulk export
+EXPORT_BATCH_SIZE = 5000
+EXPORT_FIELDS = [
+    "id", "name", "type", "subtype", "status", "condition", "city", "district", "description",
+    "installation_date", "last_maintenance", "created_by", "created_at", "updated_at"
+]
+EXPORT_DATETIME_FIELDS = ["installation_date", "last_maintenance", "created_at", "updated_at"]
+EXPORT_FORMATS = {
+    "geojson": ("application/geo+json", "geojson"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "geoparquet": ("application/vnd.apache.parquet", "parquet"),
+}
+GEOPARQUET_SCHEMA = pa.schema(
+    [(field, pa.timestamp("ms") if field in EXPORT_DATETIME_FIELDS else pa.string()) for field in EXPORT_FIELDS]
+    + [("geometry", pa.binary())],
+    metadata={"geo": json.dumps({
+        "version": "1.0.0",
+        "primary_column": "geometry",
+        "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["Point"]}}
+    })}
+)
+
+# Versioned response cache for map and analytics reads
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '256'))
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '600'))
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+# Batch updates
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '10000'))
+# Per-item writes of a batch in flight at once; kept well below MONGO_MAX_POOL_SIZE
+BATCH_WRITE_CONCURRENCY = int(os.environ.get('BATCH_WRITE_CONCURRENCY', '32'))
+
+# Delta sync
+SYNC_PAGE_SIZE = 1000
+# updated_at is stamped before the write commits, so a row can become visible after a later-stamped one
+# was synced. The high-water mark trails the clock by this much so such rows are sent on the next sync;
+# clients apply upserts and deletes by id, so the repeats are harmless
+SYNC_SAFETY_WINDOW_SECONDS = float(os.environ.get('SYNC_SAFETY_WINDOW_SECONDS', '60'))
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', '90'))
+
+# Maintenance history
+# Inserts, deletes and changes to these fields are appended to the history log
+HISTORY_FIELDS = ["city", "type", "status", "condition", "last_maintenance"]
+HISTORY_GRANULARITIES = ["day", "month"]
+HISTORY_REBUILD_BATCH_SIZE = 5000
+NAMESPACE_EXISTS = 48
+TRENDS_DEFAULT_PERIODS = {"day": 30, "month": 12}
+TRENDS_MAX_PERIODS = 1000
+
+# Repair priority
+# Each factor scores 0..1 and the weighted mean is scaled by the city and district weights (population or
+# any other planning weight, default 1). PRIORITY_MODEL (JSON) overrides top-level keys; ?weights= re-weights factors
+PRIORITY_FACTORS = ["condition", "status", "age", "maintenance", "criticality"]
+PRIORITY_MODEL = {
+    "weights": {"condition": 0.3, "status": 0.25, "age": 0.1, "maintenance": 0.15, "criticality": 0.2},
+    "condition_scores": {"critical": 1.0, "poor": 0.75, "fair": 0.4, "good": 0.15, "excellent": 0.0},
+    "status_scores": {"damaged": 1.0, "needs_repair": 0.8, "under_maintenance": 0.3, "operational": 0.0},
+    "type_criticality": {"water": 1.0, "electricity": 1.0, "sewage": 0.8, "telecommunications": 0.6, "roads": 0.6, "public_facilities": 0.5},
+    # Assets this old, or this long without maintenance, score 1 on age and maintenance
+    "age_horizon_years": 40,
+    "maintenance_horizon_years": 10,
+    "city_weights": {},
+    "district_weights": {},
+    # Score for unknown categories and missing dates
+    "unknown_score": 0.5,
+    **json.loads(os.environ.get('PRIORITY_MODEL', '{}')),
+}
+PRIORITY_DEFAULT_K = 20
+PRIORITY_MAX_K = 1000
+PRIORITY_LOAD_BATCH_SIZE = 10000
+
+# Damage heatmap
+DAMAGE_STATUSES = ["damaged", "needs_repair"]
+DAMAGE_CONDITIONS = ["critical"]
+HEATMAP_DEFAULT_RESOLUTION = 0.1
+HEATMAP_MIN_RESOLUTION = 0.001
+HEATMAP_MAX_CELLS = int(os.environ.get('HEATMAP_MAX_CELLS', '250000'))
+
+# Utility networks
+# Assets in these states no longer pass service on to the assets downstream of them
+NETWORK_OUT_OF_SERVICE_STATUSES = ["damaged", "under_maintenance"]
+
+# Search
+SEARCH_FIELD_WEIGHTS = {"name": 3.0, "district": 2.0, "description": 1.0}
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+# Query tokens shorter than this only match whole words
+SEARCH_MIN_PREFIX = 2
+SEARCH_MAX_EXPANSIONS = 64
+SEARCH_PREFIX_FACTOR = 0.5
+SEARCH_FUZZY_FACTOR = 0.3
+SEARCH_FUZZY_MIN_LENGTH = 4
+
+# Background jobs
+# Workers per process; API-only processes can run with 0 and leave jobs to dedicated workers
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# Jobs running at once per role, across all processes; each running job holds one of its role's job_slots rows
+JOB_ROLE_LIMITS = {"ministry": 4, "directorate": 2, "municipality": 1}
+JOB_MAX_ACTIVE_PER_USER = int(os.environ.get('JOB_MAX_ACTIVE_PER_USER', '5'))
+JOB_POLL_SECONDS = 2
+JOB_PROGRESS_INTERVAL_SECONDS = 1
+# Running jobs without a heartbeat for this long are assumed orphaned by a dead process and requeued
+JOB_STALE_SECONDS = 300
+JOB_HEARTBEAT_SECONDS = 30
+JOB_RECOVERY_INTERVAL_SECONDS = 60
+JOB_FINISH_ATTEMPTS = 5
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', '7'))
+JOB_PURGE_INTERVAL_SECONDS = 3600
+JOB_SPOOL_BYTES = 64 * 1024 * 1024
+
+# Change feed
+CHANGE_FEED_BUFFER = 1000
+CHANGE_FEED_QUEUE_SIZE = 1000
+CHANGE_FEED_HEARTBEAT_SECONDS = 15
+CHANGE_FEED_RETRY_SECONDS = 1
+CHANGE_FEED_FIELDS = ["id", "name", "type", "status", "condition", "city", "district", "coordinates", "updated_at"]
+CHANGE_STREAMS_UNSUPPORTED = 40573
+# Summary collections written by other processes' hooks after their main write; changes to them
+# only invalidate cached responses
+CHANGE_FEED_SUMMARY_COLLECTIONS = ["infrastructure_stats", "infrastructure_rollups"]
+
+# Users, from national to local scope
+USER_ROLES = ["ministry", "directorate", "municipality"]
+
+# Authenticated user cache
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+
+# Rate limiting
+# Token buckets per user (per client address for login/register and anonymous calls): (tokens per second, burst).
+# Behind a proxy run uvicorn with --proxy-headers so the client address is the caller's, not the proxy's
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_MAX_KEYS = 100000
+RATE_LIMITS = {
+    "auth": (float(os.environ.get('RATE_LIMIT_AUTH_PER_SECOND', '0.5')), float(os.environ.get('RATE_LIMIT_AUTH_BURST', '20'))),
+    "cheap": (float(os.environ.get('RATE_LIMIT_CHEAP_PER_SECOND', '20')), float(os.environ.get('RATE_LIMIT_CHEAP_BURST', '100'))),
+    "expensive": (float(os.environ.get('RATE_LIMIT_EXPENSIVE_PER_SECOND', '5')), float(os.environ.get('RATE_LIMIT_EXPENSIVE_BURST', '30'))),
+    # A map view fetches a few dozen tiles at once, so tiles get a larger burst than other scans
+    "tiles": (float(os.environ.get('RATE_LIMIT_TILES_PER_SECOND', '10')), float(os.environ.get('RATE_LIMIT_TILES_BURST', '80'))),
+}
+# Budgets are scaled by role; national users cover many more assets than a single municipality
+RATE_LIMIT_ROLE_MULTIPLIERS = {"ministry": 4.0, "directorate": 2.0, "municipality": 1.0}
+# Routes that scan, aggregate or write many assets; everything else under /api is cheap unless costed by its query below
+RATE_LIMIT_ROUTES = [
+    ({"POST"}, re.compile(r"^/api/auth/(login|register)$"), "auth"),
+    ({"GET"}, re.compile(r"^/api/infrastructure/(export|search|geojson|clusters)$"), "expensive"),
+    ({"GET"}, re.compile(r"^/api/tiles/"), "tiles"),
+    ({"POST"}, re.compile(r"^/api/infrastructure/bulk$"), "expensive"),
+    ({"PATCH", "DELETE"}, re.compile(r"^/api/infrastructure$"), "expensive"),
+    ({"GET"}, re.compile(r"^/api/(analytics/|network/(route|downstream/))"), "expensive"),
+    ({"POST"}, re.compile(r"^/api/jobs/"), "expensive"),
+]
+# Inventory reads are costed by their query: streams and pages above this size scan like the routes above
+RATE_LIMIT_PAGED_ROUTES = re.compile(r"^/api/infrastructure(/changes)?$")
+RATE_LIMIT_CHEAP_PAGE_SIZE = int(os.environ.get('RATE_LIMIT_CHEAP_PAGE_SIZE', '100'))
+# Requests in flight per process before new ones are shed with 429; kept below what the event loop
+# and MONGO_MAX_POOL_SIZE can absorb so overload is refused up front instead of queueing into timeouts
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '200'))
+MAX_CONCURRENT_EXPENSIVE_REQUESTS = int(os.environ.get('MAX_CONCURRENT_EXPENSIVE_REQUESTS', '20'))
+# Long-lived streams hold a slot for their whole life, so they are limited by rate only
+RATE_LIMIT_LONG_LIVED_PATHS = {"/api/infrastructure/stream"}
+
+# Pagination
+INFRASTRUCTURE_PAGE_SIZE = 1000
+INFRASTRUCTURE_MAX_PAGE_SIZE = 5000
+INFRASTRUCTURE_STREAM_BATCH_SIZE = 500
+INFRASTRUCTURE_SORT = [("updated_at", 1), ("id", 1)]
+
+# Spatial queries
+EARTH_RADIUS_M = 6378100
+DEFAULT_RADIUS_M = 1000
+# Counter-clockwise rings are read as the enclosed area even when wider than a hemisphere
+STRICT_WINDING_CRS = {"type": "name", "properties": {"name": "urn:x-mongodb:crs:strictwinding:EPSG:4326"}}
+# Map tiles are 256px wide; clusters are bucketed on a 64px grid
+CLUSTER_CELLS_PER_TILE = 4
+MAX_ZOOM = 22
+# Bounding-box polygons are widened for the geodesic bow of their edges, plus a margin for rounding.
+# Near 180 degrees wide the widened edges would run to the equator, so wider boxes skip the polygon
+BBOX_PAD_MARGIN = 1e-6
+BBOX_MAX_POLYGON_WIDTH = 170.0
+
+# Vector tiles
+MVT_EXTENT = 4096
+MVT_LAYER_NAME = "infrastructure"
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+# Below this zoom a tile spans too much of the globe for a geodesic bbox query to be accurate,
+# so those tiles are bounded with a planar coordinate range instead
+MVT_MIN_QUERY_ZOOM = 4
+# Properties sent per zoom band; zoomed-out tiles only need enough to style a dot
+MVT_PROPERTIES = [
+    (0, ["id", "type", "status"]),
+    (10, ["id", "type", "status", "condition", "city"]),
+    (14, ["id", "name", "type", "subtype", "status", "condition", "city", "district"]),
+]
+
+# Collection versions, bumped on every write and used as cache validators
+BOOT_ID = uuid.uuid4().hex[:8]
+collection_versions = {"infrastructure": 0}
+
+def bump_collection_version(name: str):
+    collection_versions[name] += 1
+
+def collection_etag(name: str, scope: dict) -> str:
+    # Scope is part of the tag so users with different role filters never share a validator
+    scope_key = json.dumps(scope, sort_keys=True, default=str)
+    digest = hashlib.sha1(f"{BOOT_ID}:{collection_versions[name]}:{scope_key}".encode('utf-8')).hexdigest()
+    return f'"{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
+async def cached_json_response(request: Request, scope: dict, build) -> Response:
+    # The ETag doubles as the cache key: it changes with the collection version and the role-scoped query
+    etag = collection_etag("infrastructure", scope)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    cached = response_cache.get(etag)
+    if cached is None:
+        content, extra_headers = await build()
+        with timed_stage("serialization"):
+            cached = (orjson.dumps(content, option=ORJSON_OPTIONS), extra_headers)
+        response_cache.set(etag, cached)
+    body, extra_headers = cached
+    return Response(content=body, media_type="application/json", headers={**headers, **extra_headers})
+
+# Caches
+# Small in-process LRU cache whose entries also expire after a fixed TTL
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+    
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def peek(self, key):
+        # Lookup that leaves recency and hit statistics alone
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+    
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def invalidate(self, key=None):
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+    
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+response_cache = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_SECONDS)
+caches = {"users": user_cache, "responses": response_cache}
+
 # User Models
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -52,6 +534,10 @@ class UserLogin(BaseModel):
     email: str
     password: str
 
+class UserUpdate(BaseModel):
+    role: Optional[str] = None
+    city: Optional[str] = None
+
 # Infrastructure Models
 class InfrastructureItem(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -70,6 +556,10 @@ class InfrastructureItem(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+# Read paths serialize raw Mongo documents projected to these fields instead of re-validating them
+INFRASTRUCTURE_FIELDS = list(InfrastructureItem.model_fields)
+GEOJSON_PROPERTIES = ["id", "name", "type", "subtype", "status", "condition", "city", "district", "description"]
+
 class InfrastructureCreate(BaseModel):
     name: str
     type: str
@@ -90,25 +580,105 @@ class InfrastructureUpdate(BaseModel):
     last_maintenance: Optional[datetime] = None
     description: Optional[str] = None
 
+class InfrastructureBatchFilter(BaseModel):
+    ids: Optional[List[str]] = None
+    bbox: Optional[str] = None
+    city: Optional[str] = None
+    type: Optional[str] = None
+    status: Optional[str] = None
+
+class InfrastructureItemUpdate(InfrastructureUpdate):
+    id: str
+
+class InfrastructureBatchUpdate(BaseModel):
+    # Either one update applied to everything matching filter, or an explicit list of per-item updates
+    filter: Optional[InfrastructureBatchFilter] = None
+    update: Optional[InfrastructureUpdate] = None
+    items: Optional[List[InfrastructureItemUpdate]] = None
+
+# A directed pipe or line carrying service from one asset to the next
+class NetworkLink(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    from_id: str
+    to_id: str
+    city: str
+    type: str
+    length_m: float
+    created_by: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class NetworkLinkCreate(BaseModel):
+    from_id: str
+    to_id: str
+    length_m: Optional[float] = None  # defaults to the straight-line distance between the assets
+
+class Job(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    kind: str  # "export", "import", "rebuild_stats"
+    status: str = "queued"  # "queued", "running", "succeeded", "failed", "cancelled"
+    params: dict = {}
+    user_id: str
+    role: str
+    progress: dict = {}
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 # Auth Functions
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
 
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+def bcrypt_queue_depth() -> int:
+    return max(bcrypt_stats["in_flight"] - BCRYPT_WORKERS, 0)
+
+async def run_bcrypt(func, *args):
+    if bcrypt_queue_depth() >= BCRYPT_MAX_QUEUE:
+        bcrypt_stats["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Authentication is busy, retry shortly", headers={"Retry-After": "1"})
+    
+    bcrypt_stats["in_flight"] += 1
+    bcrypt_stats["max_queued"] = max(bcrypt_stats["max_queued"], bcrypt_queue_depth())
+    try:
+        with timed_stage("bcrypt"):
+            return await asyncio.get_running_loop().run_in_executor(bcrypt_executor, func, *args)
+    finally:
+        bcrypt_stats["in_flight"] -= 1
+
 def create_token(user_id: str) -> str:
     payload = {"user_id": user_id, "exp": datetime.utcnow().timestamp() + 86400}
     return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await resolve_token_user(credentials.credentials)
+
+async def get_stream_user(
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    if credentials:
+        return await resolve_token_user(credentials.credentials)
+    if token:
+        return await resolve_token_user(token)
+    raise HTTPException(status_code=403, detail="Not authenticated")
+
+async def resolve_token_user(token: str) -> User:
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=["HS256"])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
         user_id = payload.get("user_id")
-        user = await db.users.find_one({"id": user_id})
-        if not user:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return User(**user)
+        user = user_cache.get(user_id)
+        if user is None:
+            user_doc = await db.users.find_one({"id": user_id})
+            if not user_doc:
+                raise HTTPException(status_code=401, detail="Invalid token")
+            user = User(**user_doc)
+            user_cache.set(user_id, user)
+        return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
@@ -123,7 +693,7 @@ async def register(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Hash password
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await run_bcrypt(hash_password, user_data.password)
     
     # Create user
     user_dict = user_data.dict()
@@ -140,21 +710,105 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login")
 async def login(login_data: UserLogin):
     user = await db.users.find_one({"email": login_data.email})
-    if not user or not verify_password(login_data.password, user["password"]):
+    if not user or not await run_bcrypt(verify_password, login_data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     token = create_token(user["id"])
     user_obj = User(**user)
     return {"token": token, "user": user_obj}
 
-# Infrastructure Routes
-@api_router.get("/infrastructure", response_model=List[InfrastructureItem])
-async def get_infrastructure(
+# User administration
+@api_router.put("/users/{user_id}", response_model=User)
+async def update_user(
+    user_id: str,
+    update_data: UserUpdate,
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role != "ministry":
+        raise HTTPException(status_code=403, detail="Only ministry users can change roles")
+    if update_data.role is not None and update_data.role not in USER_ROLES:
+        raise HTTPException(status_code=400, detail=f"role must be one of {', '.join(USER_ROLES)}")
+    
+    update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
+    if update_dict:
+        await db.users.update_one({"id": user_id}, {"$set": update_dict})
+    
+    user = await db.users.find_one({"id": user_id})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # Cached copies still carry the old role and city scope
+    user_cache.invalidate(user_id)
+    return User(**user)
+
+# Infrastructure Helpers
+def point_location(coordinates: List[float]) -> dict:
+    if len(coordinates) != 2 or not (-180 <= coordinates[0] <= 180 and -90 <= coordinates[1] <= 90):
+        raise HTTPException(status_code=400, detail="Coordinates must be [longitude, latitude]")
+    return {"type": "Point", "coordinates": [coordinates[0], coordinates[1]]}
+
+def infrastructure_document(item_obj: InfrastructureItem) -> dict:
+    # Stored documents carry a GeoJSON copy of the coordinates for the 2dsphere index
+    item_doc = item_obj.dict()
+    item_doc["location"] = point_location(item_obj.coordinates)
+    return item_doc
+
+def parse_floats(value: str, count: int, name: str) -> List[float]:
+    try:
+        numbers = [float(part) for part in value.split(",")]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count:
+        raise HTTPException(status_code=400, detail=f"{name} must be {count} comma-separated numbers")
+    return numbers
+
+def parse_bbox(bbox: str) -> List[float]:
+    min_lon, min_lat, max_lon, max_lat = parse_floats(bbox, 4, "bbox")
+    min_lon, max_lon = max(min_lon, -180.0), min(max_lon, 180.0)
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+    if min_lon >= max_lon or min_lat >= max_lat:
+        raise HTTPException(status_code=400, detail="bbox must be minLon,minLat,maxLon,maxLat")
+    return [min_lon, min_lat, max_lon, max_lat]
+
+def geodesic_edge_lat(lat: float, width: float) -> float:
+    # Latitude for the ends of a geodesic edge whose midpoint, the point nearest the pole, lies on lat
+    return math.degrees(math.atan(math.tan(math.radians(lat)) * math.cos(math.radians(width) / 2)))
+
+def bbox_filter(bbox: List[float]) -> dict:
+    # Polygon edges are geodesics, so an edge along a parallel bows toward the pole and would cut into
+    # the rectangle. The indexed polygon is widened until its edges clear the rectangle and the exact
+    # rectangle is applied as coordinate ranges; boxes too wide to widen use the ranges alone
+    min_lon, min_lat, max_lon, max_lat = bbox
+    exact = {"coordinates.0": {"$gte": min_lon, "$lte": max_lon}, "coordinates.1": {"$gte": min_lat, "$lte": max_lat}}
+    width = max_lon - min_lon
+    if width > BBOX_MAX_POLYGON_WIDTH:
+        return exact
+    south = min(min_lat, geodesic_edge_lat(min_lat, width)) - BBOX_PAD_MARGIN
+    north = max(max_lat, geodesic_edge_lat(max_lat, width)) + BBOX_PAD_MARGIN
+    ring = [[min_lon, south], [max_lon, south], [max_lon, north], [min_lon, north], [min_lon, south]]
+    return {"location": {"$geoWithin": {"$geometry": {
+        "type": "Polygon",
+        "coordinates": [ring],
+        "crs": STRICT_WINDING_CRS
+    }}}, **exact}
+
+def near_filter(near: str, radius_m: Optional[float]) -> dict:
+    lon, lat = parse_floats(near, 2, "near")
+    point_location([lon, lat])
+    radius = radius_m if radius_m is not None else DEFAULT_RADIUS_M
+    if radius <= 0:
+        raise HTTPException(status_code=400, detail="radius_m must be positive")
+    return {"location": {"$geoWithin": {"$centerSphere": [[lon, lat], radius / EARTH_RADIUS_M]}}}
+
+def build_infrastructure_query(
+    current_user: User,
     type: Optional[str] = None,
     city: Optional[str] = None,
     status: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
-):
+    bbox: Optional[str] = None,
+    near: Optional[str] = None,
+    radius_m: Optional[float] = None
+) -> dict:
     query = {}
     
     # Role-based filtering
@@ -168,174 +822,2949 @@ async def get_infrastructure(
     if status:
         query["status"] = status
     
-    items = await db.infrastructure.find(query).to_list(1000)
-    return [InfrastructureItem(**item) for item in items]
+    # Spatial filtering
+    spatial = []
+    if bbox:
+        spatial.append(bbox_filter(parse_bbox(bbox)))
+    if near:
+        spatial.append(near_filter(near, radius_m))
+    if len(spatial) == 1:
+        query.update(spatial[0])
+    elif spatial:
+        query["$and"] = spatial
+    
+    return query
 
-@api_router.post("/infrastructure", response_model=InfrastructureItem)
-async def create_infrastructure(
-    item_data: InfrastructureCreate,
-    current_user: User = Depends(get_current_user)
-):
-    # Role-based validation
-    if current_user.role == "municipality" and current_user.city:
-        if item_data.city != current_user.city:
-            raise HTTPException(status_code=403, detail="Can only create infrastructure in your city")
+def encode_cursor(item: dict) -> str:
+    raw = json.dumps({"updated_at": item["updated_at"].isoformat(), "id": item["id"]})
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('utf-8')
+
+def decode_cursor(cursor: str) -> dict:
+    # Keyset condition: everything strictly after (updated_at, id) of the last item sent
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        updated_at = datetime.fromisoformat(raw["updated_at"])
+        item_id = str(raw["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"updated_at": {"$gt": updated_at}},
+        {"updated_at": updated_at, "id": {"$gt": item_id}}
+    ]}
+
+def parse_fields(fields: Optional[str], allowed: List[str], required: List[str]) -> List[str]:
+    if not fields:
+        return allowed
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return required + [name for name in names if name not in required]
+
+def infrastructure_projection(names: List[str]) -> dict:
+    return {"_id": 0, **{name: 1 for name in names}}
+
+async def stream_infrastructure_ndjson(query: dict, projection: dict):
+    cursor = db.infrastructure.find(query, projection).sort(INFRASTRUCTURE_SORT).batch_size(INFRASTRUCTURE_STREAM_BATCH_SIZE)
+    async for item in cursor:
+        yield orjson.dumps(item) + b"\n"
+
+# Write gate
+# Inventory writes hold the gate shared from their main write until their hooks have run; summary
+# rebuilds take it alone while they read their source and while they swap, so at both points every
+# write of this process is either fully applied or not started
+class WriteGate:
+    def __init__(self):
+        self.writers = 0
+        self.held = False
+        self.waiting = 0
+        self.condition = asyncio.Condition()
     
-    item_dict = item_data.dict()
-    item_dict["created_by"] = current_user.id
-    item_obj = InfrastructureItem(**item_dict)
+    @asynccontextmanager
+    async def shared(self):
+        async with self.condition:
+            # Queued rebuilds go first so a steady stream of writes cannot starve them
+            await self.condition.wait_for(lambda: not self.held and not self.waiting)
+            self.writers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writers -= 1
+                self.condition.notify_all()
     
-    await db.infrastructure.insert_one(item_obj.dict())
-    return item_obj
+    @asynccontextmanager
+    async def exclusive(self):
+        async with self.condition:
+            self.waiting += 1
+            try:
+                await self.condition.wait_for(lambda: not self.held and not self.writers)
+            finally:
+                self.waiting -= 1
+            self.held = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.held = False
+                self.condition.notify_all()
 
-@api_router.put("/infrastructure/{item_id}", response_model=InfrastructureItem)
-async def update_infrastructure(
-    item_id: str,
-    update_data: InfrastructureUpdate,
-    current_user: User = Depends(get_current_user)
-):
-    item = await db.infrastructure.find_one({"id": item_id})
-    if not item:
-        raise HTTPException(status_code=404, detail="Infrastructure item not found")
+write_gate = WriteGate()
+# Hook operations recorded while a summary collection is being rebuilt, replayed onto the rebuilt rows
+summary_buffers = {}
+summary_rebuild_locks = defaultdict(asyncio.Lock)
+
+# Summary statistics, kept as one counter row per (city, field, value)
+STATS_FIELDS = ["type", "status", "condition"]
+
+def stats_deltas(changes: List[tuple]) -> Counter:
+    deltas = Counter()
+    for old, new in changes:
+        for field in STATS_FIELDS:
+            if old is not None:
+                deltas[(old["city"], field, old.get(field))] -= 1
+            if new is not None:
+                deltas[(new["city"], field, new.get(field))] += 1
+    return deltas
+
+async def apply_stats_deltas(changes: List[tuple]):
+    operations = [
+        UpdateOne({"city": city, "field": field, "value": value}, {"$inc": {"count": delta}}, upsert=True)
+        for (city, field, value), delta in stats_deltas(changes).items()
+        if delta
+    ]
+    if operations:
+        await db.infrastructure_stats.bulk_write(operations, ordered=False)
+        if "infrastructure_stats" in summary_buffers:
+            summary_buffers["infrastructure_stats"].extend(operations)
+
+async def facet_distributions(query: dict) -> dict:
+    # One pass over the matching documents instead of one aggregation per field
+    pipeline = [
+        {"$match": query},
+        {"$facet": {
+            field: [{"$group": {"_id": {"city": "$city", "value": f"${field}"}, "count": {"$sum": 1}}}]
+            for field in STATS_FIELDS
+        }}
+    ]
+    result = await db.infrastructure.aggregate(pipeline).to_list(None)
+    return result[0] if result else {field: [] for field in STATS_FIELDS}
+
+async def replace_collection(name: str, rows: List[dict]):
+    # Fills a staging collection with its declared indexes and renames it over the live one, so readers
+    # see either the old rows or the new ones, never an empty or half-written collection. Deltas buffered
+    # since the rows were read are replayed onto staging first, with writes held off until the swap
+    staging = db[f"{name}_rebuild_{uuid.uuid4().hex[:8]}"]
+    try:
+        await db.create_collection(staging.name)
+        for spec in INDEX_SPECS.get(name, []):
+            keys = list(spec["keys"])
+            options = {option: spec[option] for option in ("unique", "expireAfterSeconds") if option in spec}
+            await staging.create_index(keys, name=index_name(keys), **options)
+        if rows:
+            await staging.insert_many(rows)
+        async with write_gate.exclusive():
+            operations = summary_buffers.pop(name, [])
+            if operations:
+                await staging.bulk_write(operations, ordered=False)
+            await staging.rename(name, dropTarget=True)
+    except BaseException:
+        await staging.drop()
+        raise
+
+async def rebuild_infrastructure_stats():
+    async with summary_rebuild_locks["infrastructure_stats"]:
+        # Each write is either in the facets or buffered from here on, never both
+        async with write_gate.exclusive():
+            facets = await facet_distributions({})
+            summary_buffers["infrastructure_stats"] = []
+        try:
+            rows = [
+                {"city": group["_id"]["city"], "field": field, "value": group["_id"].get("value"), "count": group["count"]}
+                for field in STATS_FIELDS
+                for group in facets[field]
+            ]
+            await replace_collection("infrastructure_stats", rows)
+        finally:
+            summary_buffers.pop("infrastructure_stats", None)
+
+# Maintenance history
+# Every change is appended to a time-series log, and per-(city, type) daily and monthly rollups are
+# incremented alongside it, so trend queries read a handful of rollup rows instead of the raw log
+HISTORY_OPERATIONS = {"insert": "inserted", "update": "updated", "delete": "deleted"}
+
+def history_snapshot(item: Optional[dict]) -> Optional[dict]:
+    return {field: item.get(field) for field in HISTORY_FIELDS} if item is not None else None
+
+def history_events(changes: List[tuple], at: datetime) -> List[dict]:
+    events = []
+    for old, new in changes:
+        before, after = history_snapshot(old), history_snapshot(new)
+        if before is not None and before == after:
+            continue
+        current = after or before
+        events.append({
+            "at": at,
+            "meta": {"city": current["city"], "type": current["type"]},
+            "asset_id": (new or old)["id"],
+            "op": "insert" if old is None else "delete" if new is None else "update",
+            "before": before,
+            "after": after,
+        })
+    return events
+
+def history_period(at: datetime, granularity: str) -> datetime:
+    if granularity == "month":
+        return datetime(at.year, at.month, 1)
+    return datetime(at.year, at.month, at.day)
+
+def next_history_period(period: datetime, granularity: str) -> datetime:
+    if granularity == "month":
+        return datetime(period.year + period.month // 12, period.month % 12 + 1, 1)
+    return period + timedelta(days=1)
+
+def rollup_value(value) -> bool:
+    # Values become field names in the rollup rows, so ones Mongo cannot store as keys are left out
+    return isinstance(value, str) and value != "" and "." not in value and not value.startswith("$")
+
+def history_rollup_increments(events: List[dict]) -> dict:
+    # (granularity, period, city, type) -> Counter of rollup fields; status and condition hold the net
+    # change in assets per value, so a period's row says how the distribution moved
+    rollups = defaultdict(Counter)
+    for event in events:
+        before, after = event["before"], event["after"]
+        maintained = after is not None and after["last_maintenance"] is not None and \
+            after["last_maintenance"] != (before or {}).get("last_maintenance")
+        for granularity in HISTORY_GRANULARITIES:
+            period = history_period(event["at"], granularity)
+            counters = rollups[(granularity, period, event["meta"]["city"], event["meta"]["type"])]
+            counters["events"] += 1
+            counters[HISTORY_OPERATIONS[event["op"]]] += 1
+            counters["maintained"] += maintained
+            for field in ("status", "condition"):
+                if before is not None and rollup_value(before[field]):
+                    rollups[(granularity, period, before["city"], before["type"])][f"{field}.{before[field]}"] -= 1
+                if after is not None and rollup_value(after[field]):
+                    counters[f"{field}.{after[field]}"] += 1
+    return rollups
+
+async def insert_history(events: List[dict]):
+    if events:
+        await db.infrastructure_history.insert_many(events, ordered=False)
+
+async def apply_history_rollups(events: List[dict]):
+    operations = []
+    for (granularity, period, city, type_), counters in history_rollup_increments(events).items():
+        increments = {field: value for field, value in counters.items() if value}
+        if increments:
+            key = {"granularity": granularity, "period": period, "city": city, "type": type_}
+            operations.append(UpdateOne(key, {"$inc": increments}, upsert=True))
+    if operations:
+        await db.infrastructure_rollups.bulk_write(operations, ordered=False)
+        if "infrastructure_rollups" in summary_buffers:
+            summary_buffers["infrastructure_rollups"].extend(operations)
+
+async def rebuild_history_rollups():
+    # Recomputes every rollup from the raw log, e.g. after changing what a rollup counts
+    async with summary_rebuild_locks["infrastructure_rollups"]:
+        # Events logged before the cutoff are read from the log and later ones are buffered as they are
+        # written. Stored times are whole milliseconds, so the cutoff is too, and writes stay held off
+        # until the clock has passed it
+        async with write_gate.exclusive():
+            cutoff = datetime.utcnow() + timedelta(milliseconds=1)
+            cutoff = cutoff.replace(microsecond=cutoff.microsecond // 1000 * 1000)
+            await asyncio.sleep(max((cutoff - datetime.utcnow()).total_seconds(), 0))
+            summary_buffers["infrastructure_rollups"] = []
+        
+        try:
+            rollups = defaultdict(Counter)
+            batch = []
+            history = db.infrastructure_history.find({"at": {"$lt": cutoff}}, {"_id": 0, "asset_id": 0}, batch_size=HISTORY_REBUILD_BATCH_SIZE)
+            async for event in history:
+                batch.append(event)
+                if len(batch) >= HISTORY_REBUILD_BATCH_SIZE:
+                    for key, counters in history_rollup_increments(batch).items():
+                        rollups[key].update(counters)
+                    batch = []
+            for key, counters in history_rollup_increments(batch).items():
+                rollups[key].update(counters)
+            
+            rows = []
+            for (granularity, period, city, type_), counters in rollups.items():
+                row = {"granularity": granularity, "period": period, "city": city, "type": type_}
+                for path, value in counters.items():
+                    if value:
+                        field, _, key = path.partition(".")
+                        if key:
+                            row.setdefault(field, {})[key] = value
+                        else:
+                            row[field] = value
+                rows.append(row)
+            await replace_collection("infrastructure_rollups", rows)
+        finally:
+            summary_buffers.pop("infrastructure_rollups", None)
+
+async def ensure_history_collection():
+    # Time-series collections need MongoDB 5.0; older servers keep the same documents in a plain collection
+    if "infrastructure_history" in await db.list_collection_names():
+        return
+    try:
+        await db.create_collection("infrastructure_history", timeseries={"timeField": "at", "metaField": "meta", "granularity": "hours"})
+    except OperationFailure as e:
+        if e.code != NAMESPACE_EXISTS:
+            logger.warning("Keeping infrastructure history in a plain collection: %s", e)
+
+# Damage heatmap
+def is_damaged(item: dict) -> bool:
+    return item.get("status") in DAMAGE_STATUSES or item.get("condition") in DAMAGE_CONDITIONS
+
+# Damaged assets are kept in memory and binned with numpy on request, so a heatmap never reads the inventory
+class DamageIndex:
+    def __init__(self):
+        self.points = {}
+        self.arrays = None
     
-    # Role-based validation
-    if current_user.role == "municipality" and current_user.city:
-        if item["city"] != current_user.city:
-            raise HTTPException(status_code=403, detail="Can only update infrastructure in your city")
+    def set(self, item: dict):
+        coordinates = item.get("coordinates") or []
+        if is_damaged(item) and len(coordinates) == 2:
+            self.points[item["id"]] = (float(coordinates[0]), float(coordinates[1]), item.get("city") or "", item.get("district") or "")
+            self.arrays = None
+        else:
+            self.remove(item["id"])
     
-    update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
-    update_dict["updated_at"] = datetime.utcnow()
+    def remove(self, item_id: str):
+        if self.points.pop(item_id, None) is not None:
+            self.arrays = None
     
-    await db.infrastructure.update_one({"id": item_id}, {"$set": update_dict})
+    def apply(self, changes: List[tuple]):
+        for old, new in changes:
+            if new is None:
+                self.remove(old["id"])
+            else:
+                self.set(new)
     
-    updated_item = await db.infrastructure.find_one({"id": item_id})
-    return InfrastructureItem(**updated_item)
+    async def rebuild(self):
+        query = {"$or": [{"status": {"$in": DAMAGE_STATUSES}}, {"condition": {"$in": DAMAGE_CONDITIONS}}]}
+        projection = {"_id": 0, "id": 1, "coordinates": 1, "city": 1, "district": 1, "status": 1, "condition": 1}
+        self.points = {}
+        self.arrays = None
+        async for item in db.infrastructure.find(query, projection):
+            self.set(item)
+    
+    def snapshot(self) -> tuple:
+        # Column arrays are rebuilt lazily after writes, once per burst rather than once per change
+        if self.arrays is None:
+            points = list(self.points.values())
+            self.arrays = (
+                np.fromiter((point[0] for point in points), dtype=float, count=len(points)),
+                np.fromiter((point[1] for point in points), dtype=float, count=len(points)),
+                np.array([point[2] for point in points], dtype=str),
+                np.array([point[3] for point in points], dtype=str),
+            )
+        return self.arrays
+    
+    def grid(self, resolution: float, bbox: Optional[List[float]], city: Optional[str], district: Optional[str]) -> dict:
+        lons, lats, cities, districts = self.snapshot()
+        mask = np.ones(len(lons), dtype=bool)
+        if city:
+            mask &= cities == city
+        if district:
+            mask &= districts == district
+        lons, lats = lons[mask], lats[mask]
+        
+        if bbox is None:
+            if not len(lons):
+                return {"bbox": None, "resolution": resolution, "width": 0, "height": 0, "total": 0, "max": 0, "cells": []}
+            bbox = [lons.min(), lats.min(), lons.max(), lats.max()]
+        
+        # Snap the extent outward to whole cells so grids at one resolution always line up
+        min_x, min_y = (round(math.floor(value / resolution) * resolution, 9) for value in bbox[:2])
+        width = max(math.ceil(round((bbox[2] - min_x) / resolution, 9)), 1)
+        height = max(math.ceil(round((bbox[3] - min_y) / resolution, 9)), 1)
+        if width * height > HEATMAP_MAX_CELLS:
+            raise HTTPException(status_code=400, detail=f"Heatmap would have {width * height} cells; use a coarser resolution or a smaller bbox")
+        max_x, max_y = min_x + width * resolution, min_y + height * resolution
+        
+        counts, _, _ = np.histogram2d(lons, lats, bins=[width, height], range=[[min_x, max_x], [min_y, max_y]])
+        xs, ys = np.nonzero(counts)
+        values = counts[xs, ys].astype(int)
+        centers_x = np.round(min_x + (xs + 0.5) * resolution, 6)
+        centers_y = np.round(min_y + (ys + 0.5) * resolution, 6)
+        return {
+            "bbox": [min_x, min_y, round(max_x, 9), round(max_y, 9)],
+            "resolution": resolution,
+            "width": width,
+            "height": height,
+            "total": int(values.sum()),
+            "max": int(values.max()) if len(values) else 0,
+            # [lon, lat, count] at each non-empty cell center
+            "cells": [list(cell) for cell in zip(centers_x.tolist(), centers_y.tolist(), values.tolist())]
+        }
 
-@api_router.delete("/infrastructure/{item_id}")
-async def delete_infrastructure(
-    item_id: str,
-    current_user: User = Depends(get_current_user)
-):
-    item = await db.infrastructure.find_one({"id": item_id})
-    if not item:
-        raise HTTPException(status_code=404, detail="Infrastructure item not found")
+damage_index = DamageIndex()
+
+# Repair priority
+PRIORITY_CATEGORIES = ["city", "district", "type", "status", "condition"]
+SECONDS_PER_YEAR = 365.25 * 86400
+
+# Inventory columns for scoring, loaded in one projected pass and reused until the next write
+class PriorityColumns:
+    def __init__(self):
+        self.version = None
+        self.columns = None
+        self.lock = asyncio.Lock()
     
-    # Role-based validation
-    if current_user.role == "municipality":
-        if current_user.city and item["city"] != current_user.city:
-            raise HTTPException(status_code=403, detail="Can only delete infrastructure in your city")
+    async def get(self) -> dict:
+        async with self.lock:
+            version = collection_versions["infrastructure"]
+            if self.version != version:
+                self.columns = await self.load()
+                self.version = version
+            return self.columns
     
-    await db.infrastructure.delete_one({"id": item_id})
-    return {"message": "Infrastructure item deleted successfully"}
+    async def load(self) -> dict:
+        # Reads the primary rather than analytics_db: a lagging secondary would pin a stale copy until the next write
+        fields = ["id", "name", "installation_date", "last_maintenance"] + PRIORITY_CATEGORIES
+        values = {field: [] for field in fields}
+        cursor = db.infrastructure.find({}, {"_id": 0, **{field: 1 for field in fields}}, batch_size=PRIORITY_LOAD_BATCH_SIZE)
+        while True:
+            batch = await cursor.to_list(PRIORITY_LOAD_BATCH_SIZE)
+            if not batch:
+                break
+            for field in fields:
+                values[field].extend([item.get(field) for item in batch])
+        
+        # Categories become integer codes into a label list; missing values get code -1
+        columns = {"id": values["id"], "name": values["name"]}
+        for field in PRIORITY_CATEGORIES:
+            codes, labels = pd.factorize(pd.Series(values[field], dtype=object))
+            columns[field] = (codes, list(labels))
+        for field in ("installation_date", "last_maintenance"):
+            columns[field] = pd.to_datetime(pd.Series(values[field], dtype=object), errors="coerce").to_numpy(dtype="datetime64[s]")
+        return columns
 
-# GeoJSON endpoint for map visualization
-@api_router.get("/infrastructure/geojson")
-async def get_infrastructure_geojson(
-    type: Optional[str] = None,
-    city: Optional[str] = None,
-    status: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
-):
-    query = {}
+priority_columns = PriorityColumns()
+
+def category_scores(column: tuple, scores: dict, default: float) -> np.ndarray:
+    codes, labels = column
+    # The trailing default serves code -1, so missing values need no separate pass
+    lookup = np.array([scores.get(label, default) for label in labels] + [default], dtype=float)
+    return lookup[codes]
+
+def years_since(dates: np.ndarray, now: datetime) -> np.ndarray:
+    # NaN where the date is missing; NaT itself casts to a huge negative number, not NaN
+    seconds = (np.datetime64(now, "s") - dates).astype(float)
+    return np.where(np.isnat(dates), np.nan, seconds) / SECONDS_PER_YEAR
+
+def priority_scores(columns: dict, model: dict, now: datetime) -> tuple:
+    unknown = model["unknown_score"]
+    installed, maintained = columns["installation_date"], columns["last_maintenance"]
+    # Never-maintained assets count from their installation
+    maintained = np.where(np.isnat(maintained), installed, maintained)
+    factors = {
+        "condition": category_scores(columns["condition"], model["condition_scores"], unknown),
+        "status": category_scores(columns["status"], model["status_scores"], unknown),
+        "age": np.nan_to_num(np.clip(years_since(installed, now) / model["age_horizon_years"], 0, 1), nan=unknown),
+        "maintenance": np.nan_to_num(np.clip(years_since(maintained, now) / model["maintenance_horizon_years"], 0, 1), nan=unknown),
+        "criticality": category_scores(columns["type"], model["type_criticality"], unknown),
+    }
+    weights = model["weights"]
+    total_weight = sum(weights.values())
+    scores = sum(factors[name] * weight for name, weight in weights.items() if weight) / total_weight
     
-    # Role-based filtering
-    if current_user.role == "municipality" and current_user.city:
-        query["city"] = current_user.city
-    elif city:
-        query["city"] = city
+    scores *= category_scores(columns["city"], model["city_weights"], 1.0)
+    if model["district_weights"]:
+        city_codes, cities = columns["city"]
+        district_codes, districts = columns["district"]
+        # City x district table; the extra last row and column hold the weight for missing values
+        table = np.ones((len(cities) + 1, len(districts) + 1))
+        city_index = {name: index for index, name in enumerate(cities)}
+        district_index = {name: index for index, name in enumerate(districts)}
+        for city, district_weights in model["district_weights"].items():
+            for district, weight in district_weights.items():
+                if city in city_index and district in district_index:
+                    table[city_index[city], district_index[district]] = weight
+        scores *= table[city_codes, district_codes]
+    return scores, factors
+
+def top_k_per_city(scores: np.ndarray, city_codes: np.ndarray, mask: np.ndarray, k: int) -> dict:
+    # City code -> row indices of its k highest scores, best first
+    result = {}
+    for code in np.unique(city_codes[mask]):
+        rows = np.flatnonzero(mask & (city_codes == code))
+        if len(rows) > k:
+            rows = rows[np.argpartition(-scores[rows], k - 1)[:k]]
+        result[int(code)] = rows[np.argsort(-scores[rows], kind="stable")]
+    return result
+
+def parse_priority_weights(weights: Optional[str]) -> dict:
+    # "condition:2,status:1" replaces the model's weights for the listed factors
+    merged = dict(PRIORITY_MODEL["weights"])
+    if not weights:
+        return merged
+    for part in weights.split(","):
+        name, _, value = part.partition(":")
+        name = name.strip()
+        if name not in PRIORITY_FACTORS:
+            raise HTTPException(status_code=400, detail=f"weights factors must be among {', '.join(PRIORITY_FACTORS)}")
+        try:
+            merged[name] = float(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid weight for {name}")
+        if not 0 <= merged[name] < math.inf:
+            raise HTTPException(status_code=400, detail=f"Invalid weight for {name}")
+    if not sum(merged.values()):
+        raise HTTPException(status_code=400, detail="At least one weight must be positive")
+    return merged
+
+# Utility networks
+def distance_m(a: List[float], b: List[float]) -> float:
+    lon1, lat1, lon2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(h))
+
+def in_service(item: dict) -> bool:
+    return item.get("status") not in NETWORK_OUT_OF_SERVICE_STATUSES
+
+def csr_adjacency(size: int, sources, targets, weights, edges) -> tuple:
+    # Row i's neighbours are indices[indptr[i]:indptr[i + 1]]; kept as lists since traversal reads one entry at a time
+    order = np.argsort(sources, kind="stable")
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=size), out=indptr[1:])
+    return indptr.tolist(), targets[order].tolist(), weights[order].tolist(), edges[order].tolist()
+
+# One city's links as CSR adjacency; rebuilt lazily when links change, while status changes only flip the mask
+class CityNetwork:
+    def __init__(self):
+        self.links = {}
+        self.status = {}
+        self.nodes = None
     
-    if type:
-        query["type"] = type
-    if status:
-        query["status"] = status
+    def add_link(self, link: dict, statuses: dict):
+        self.links[link["id"]] = (link["from_id"], link["to_id"], link["length_m"])
+        self.status.update(statuses)
+        self.nodes = None
     
-    items = await db.infrastructure.find(query).to_list(1000)
+    def remove_link(self, link_id: str):
+        if self.links.pop(link_id, None) is not None:
+            self.nodes = None
     
-    features = []
-    for item in items:
-        point = Point(item["coordinates"])
-        properties = {
-            "id": item["id"],
-            "name": item["name"],
-            "type": item["type"],
-            "subtype": item.get("subtype"),
-            "status": item["status"],
-            "condition": item["condition"],
-            "city": item["city"],
-            "district": item.get("district"),
-            "description": item.get("description")
-        }
-        feature = Feature(geometry=point, properties=properties)
-        features.append(feature)
+    def set_status(self, node_id: str, value: bool):
+        if node_id in self.status:
+            self.status[node_id] = value
+            if self.nodes is not None and node_id in self.index:
+                self.mask[self.index[node_id]] = value
     
-    return FeatureCollection(features)
-
-# Analytics Routes
-@api_router.get("/analytics/overview")
-async def get_analytics_overview(current_user: User = Depends(get_current_user)):
-    query = {}
-    if current_user.role == "municipality" and current_user.city:
-        query["city"] = current_user.city
+    def build(self):
+        if self.nodes is not None:
+            return
+        link_ids = list(self.links)
+        nodes = sorted({node for from_id, to_id, _ in self.links.values() for node in (from_id, to_id)})
+        self.index = {node: i for i, node in enumerate(nodes)}
+        self.status = {node: self.status.get(node, True) for node in nodes}
+        self.link_ids = link_ids
+        
+        sources = np.array([self.index[self.links[link_id][0]] for link_id in link_ids], dtype=np.int64)
+        targets = np.array([self.index[self.links[link_id][1]] for link_id in link_ids], dtype=np.int64)
+        lengths = np.array([self.links[link_id][2] for link_id in link_ids], dtype=float)
+        edges = np.arange(len(link_ids))
+        self.forward = csr_adjacency(len(nodes), sources, targets, lengths, edges)
+        # Crews can travel a line in either direction
+        self.undirected = csr_adjacency(
+            len(nodes), np.concatenate([sources, targets]), np.concatenate([targets, sources]), np.tile(lengths, 2), np.tile(edges, 2)
+        )
+        # Roots are the supply points: assets nothing feeds into
+        self.roots = np.flatnonzero(np.bincount(targets, minlength=len(nodes)) == 0).tolist()
+        self.mask = [self.status[node] for node in nodes]
+        self.nodes = nodes
     
-    # Get total counts by type
-    pipeline = [
-        {"$match": query},
-        {"$group": {"_id": "$type", "count": {"$sum": 1}}}
-    ]
+    def served(self, mask: List[bool]) -> List[bool]:
+        # Assets reachable from a root through in-service assets only
+        indptr, indices, _, _ = self.forward
+        seen = [False] * len(self.nodes)
+        queue = deque()
+        for root in self.roots:
+            if mask[root]:
+                seen[root] = True
+                queue.append(root)
+        while queue:
+            node = queue.popleft()
+            for neighbour in indices[indptr[node]:indptr[node + 1]]:
+                if mask[neighbour] and not seen[neighbour]:
+                    seen[neighbour] = True
+                    queue.append(neighbour)
+        return seen
     
-    type_counts = await db.infrastructure.aggregate(pipeline).to_list(None)
+    def downstream(self, node_id: str) -> List[str]:
+        # Assets served while node_id works that lose service once it fails; redundant feeds keep assets served
+        self.build()
+        if node_id not in self.index:
+            return []
+        node = self.index[node_id]
+        working, failed = list(self.mask), list(self.mask)
+        working[node], failed[node] = True, False
+        before, after = self.served(working), self.served(failed)
+        return [self.nodes[i] for i in range(len(self.nodes)) if before[i] and not after[i] and i != node]
     
-    # Get status counts
-    status_pipeline = [
-        {"$match": query},
-        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
-    ]
+    def route(self, from_id: str, to_id: str, avoid_out_of_service: bool) -> Optional[dict]:
+        # Dijkstra over link lengths
+        self.build()
+        if from_id not in self.index or to_id not in self.index:
+            return None
+        indptr, indices, weights, edges = self.undirected
+        start, goal = self.index[from_id], self.index[to_id]
+        blocked = [not value for value in self.mask] if avoid_out_of_service else [False] * len(self.nodes)
+        blocked[goal] = False
+        distances = [math.inf] * len(self.nodes)
+        distances[start] = 0.0
+        previous = {}
+        heap = [(0.0, start)]
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if node == goal:
+                break
+            if distance > distances[node]:
+                continue
+            lo, hi = indptr[node], indptr[node + 1]
+            for neighbour, weight, edge in zip(indices[lo:hi], weights[lo:hi], edges[lo:hi]):
+                candidate = distance + weight
+                if candidate < distances[neighbour] and not blocked[neighbour]:
+                    distances[neighbour] = candidate
+                    previous[neighbour] = (node, edge)
+                    heapq.heappush(heap, (candidate, neighbour))
+        if distances[goal] == math.inf:
+            return None
+        
+        path, links, node = [goal], [], goal
+        while node != start:
+            node, edge = previous[node]
+            path.append(node)
+            links.append(edge)
+        return {
+            "distance_m": round(distances[goal], 1),
+            "path": [self.nodes[node] for node in reversed(path)],
+            "links": [self.link_ids[edge] for edge in reversed(links)]
+        }
+
+class NetworkGraphs:
+    def __init__(self):
+        self.cities = {}
+        self.node_cities = {}
     
-    status_counts = await db.infrastructure.aggregate(status_pipeline).to_list(None)
+    def city(self, name: str) -> CityNetwork:
+        return self.cities.setdefault(name, CityNetwork())
     
-    # Get condition counts
-    condition_pipeline = [
-        {"$match": query},
-        {"$group": {"_id": "$condition", "count": {"$sum": 1}}}
-    ]
+    def add_link(self, link: dict, statuses: dict):
+        self.city(link["city"]).add_link(link, statuses)
+        self.node_cities[link["from_id"]] = self.node_cities[link["to_id"]] = link["city"]
     
-    condition_counts = await db.infrastructure.aggregate(condition_pipeline).to_list(None)
+    def remove_link(self, link: dict):
+        self.city(link["city"]).remove_link(link["id"])
     
-    return {
-        "type_distribution": {item["_id"]: item["count"] for item in type_counts},
-        "status_distribution": {item["_id"]: item["count"] for item in status_counts},
-        "condition_distribution": {item["_id"]: item["count"] for item in condition_counts}
-    }
+    def set_status(self, item: dict):
+        city = self.node_cities.get(item["id"])
+        if city:
+            self.cities[city].set_status(item["id"], in_service(item))
+    
+    async def load(self):
+        links = await db.infrastructure_links.find({}, {"_id": 0}).to_list(None)
+        node_ids = list({link["from_id"] for link in links} | {link["to_id"] for link in links})
+        statuses = {}
+        async for item in db.infrastructure.find({"id": {"$in": node_ids}}, {"_id": 0, "id": 1, "status": 1}):
+            statuses[item["id"]] = in_service(item)
+        self.cities, self.node_cities = {}, {}
+        for link in links:
+            self.add_link(link, {node: statuses.get(node, True) for node in (link["from_id"], link["to_id"])})
+    
+    async def apply(self, changes: List[tuple]):
+        removed = []
+        for old, new in changes:
+            if new is None:
+                if old["id"] in self.node_cities:
+                    removed.append(old["id"])
+            else:
+                self.set_status(new)
+        if not removed:
+            return
+        
+        # Links cannot outlive either of their assets
+        links = await db.infrastructure_links.find(
+            {"$or": [{"from_id": {"$in": removed}}, {"to_id": {"$in": removed}}]}, {"_id": 0, "id": 1, "city": 1}
+        ).to_list(None)
+        if links:
+            await db.infrastructure_links.delete_many({"id": {"$in": [link["id"] for link in links]}})
+        for link in links:
+            self.remove_link(link)
+        for node_id in removed:
+            self.node_cities.pop(node_id, None)
 
-# Cities endpoint
-@api_router.get("/cities")
-async def get_cities():
-    cities = await db.infrastructure.distinct("city")
-    return cities
+network_graphs = NetworkGraphs()
 
-# Test endpoint
-@api_router.get("/")
-async def root():
-    return {"message": "Syrian Infrastructure GIS API"}
+# Search
+ARABIC_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+ARABIC_FOLDING = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ئ": "ي", "ؤ": "و", "ة": "ه"})
+SEARCH_TOKEN = re.compile(r"\w+")
+# Attached article and conjunction forms, longest first
+ARABIC_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
 
-# Include the router in the main app
-app.include_router(api_router)
+def normalize_arabic(text: str) -> str:
+    return ARABIC_DIACRITICS.sub("", text).translate(ARABIC_FOLDING).lower()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@lru_cache(maxsize=65536)
+def strip_arabic_prefix(token: str) -> str:
+    for prefix in ARABIC_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+def search_tokens(text: Optional[str]) -> List[str]:
+    return SEARCH_TOKEN.findall(normalize_arabic(text)) if text else []
+
+def deletion_variants(term: str) -> List[str]:
+    return [term[:i] + term[i + 1:] for i in range(len(term))]
+
+# In-process inverted index over name, district and description, kept in sync by the write hook.
+# Postings are dicts for cheap updates with a lazily built numpy copy for scoring; filters are
+# per-document code arrays, so a query is a handful of vectorized passes over at most one float per asset
+class SearchIndex:
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        # Ordinals are reused: an updated asset keeps its slot and a deleted one's slot goes to the next insert
+        self.ordinals = {}
+        self.ids = []
+        self.doc_terms = []
+        self.doc_texts = []
+        self.free = []
+        self.alive = np.zeros(1024, dtype=bool)
+        self.filters = {field: np.full(1024, -1, dtype=np.int32) for field in ("city", "type", "status")}
+        self.codes = {field: {} for field in self.filters}
+        self.postings = {}
+        self.posting_arrays = {}
+        # Sorted for prefix lookups with bisect, plus single-deletion variants for edit-distance-1 matches
+        self.vocabulary = []
+        self.deletions = defaultdict(set)
+    
+    def document_terms(self, item: dict) -> dict:
+        weights = {}
+        for field, weight in SEARCH_FIELD_WEIGHTS.items():
+            for token in search_tokens(item.get(field)):
+                for term in {token, strip_arabic_prefix(token)}:
+                    weights[term] = weights.get(term, 0.0) + weight
+        return weights
+    
+    def add_term(self, term: str):
+        self.postings[term] = {}
+        bisect.insort(self.vocabulary, term)
+        for variant in deletion_variants(term):
+            self.deletions[variant].add(term)
+    
+    def allocate(self, item_id: str) -> int:
+        if self.free:
+            ordinal = self.free.pop()
+            self.ids[ordinal] = item_id
+        else:
+            ordinal = len(self.ids)
+            if ordinal == len(self.alive):
+                self.alive = np.concatenate([self.alive, np.zeros(ordinal, dtype=bool)])
+                self.filters = {field: np.concatenate([codes, np.full(ordinal, -1, dtype=np.int32)]) for field, codes in self.filters.items()}
+            self.ids.append(item_id)
+            self.doc_terms.append({})
+            self.doc_texts.append(None)
+        self.ordinals[item_id] = ordinal
+        self.alive[ordinal] = True
+        return ordinal
+    
+    def clear_terms(self, ordinal: int):
+        for term in self.doc_terms[ordinal]:
+            del self.postings[term][ordinal]
+            self.posting_arrays.pop(term, None)
+        self.doc_terms[ordinal] = {}
+        self.doc_texts[ordinal] = None
+    
+    def set(self, item: dict):
+        ordinal = self.ordinals.get(item["id"])
+        if ordinal is None:
+            ordinal = self.allocate(item["id"])
+        for field, codes in self.filters.items():
+            codes[ordinal] = self.codes[field].setdefault(item.get(field), len(self.codes[field]))
+        
+        # Status and other non-text updates only touch the filter codes above
+        text = tuple(item.get(field) for field in SEARCH_FIELD_WEIGHTS)
+        if text == self.doc_texts[ordinal]:
+            return
+        self.clear_terms(ordinal)
+        terms = self.document_terms(item)
+        self.doc_terms[ordinal] = terms
+        self.doc_texts[ordinal] = text
+        for term, weight in terms.items():
+            if term not in self.postings:
+                self.add_term(term)
+            self.postings[term][ordinal] = weight
+            self.posting_arrays.pop(term, None)
+    
+    def remove(self, item_id: str):
+        ordinal = self.ordinals.pop(item_id, None)
+        if ordinal is None:
+            return
+        self.alive[ordinal] = False
+        self.clear_terms(ordinal)
+        self.ids[ordinal] = None
+        self.free.append(ordinal)
+    
+    def apply(self, changes: List[tuple]):
+        for old, new in changes:
+            if new is None:
+                self.remove(old["id"])
+            else:
+                self.set(new)
+    
+    async def rebuild(self):
+        self.reset()
+        projection = infrastructure_projection(["id", "city", "type", "status"] + list(SEARCH_FIELD_WEIGHTS))
+        async for item in db.infrastructure.find({}, projection):
+            self.set(item)
+    
+    def posting_array(self, term: str) -> tuple:
+        if term not in self.posting_arrays:
+            postings = self.postings[term]
+            self.posting_arrays[term] = (
+                np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                np.fromiter(postings.values(), dtype=float, count=len(postings))
+            )
+        return self.posting_arrays[term]
+    
+    def expand(self, token: str) -> List[tuple]:
+        # (term, factor): the exact word, then words it prefixes, then edit-distance-1 typos if nothing else matched
+        terms = [(token, 1.0)] if self.postings.get(token) else []
+        if len(token) >= SEARCH_MIN_PREFIX:
+            start = bisect.bisect_right(self.vocabulary, token)
+            for term in self.vocabulary[start:start + SEARCH_MAX_EXPANSIONS]:
+                if not term.startswith(token):
+                    break
+                if self.postings[term]:
+                    terms.append((term, SEARCH_PREFIX_FACTOR))
+        if terms or len(token) < SEARCH_FUZZY_MIN_LENGTH:
+            return terms
+        
+        candidates = set(self.deletions.get(token, ())) | {variant for variant in deletion_variants(token) if variant in self.postings}
+        for variant in deletion_variants(token):
+            candidates |= self.deletions.get(variant, set())
+        return [(term, SEARCH_FUZZY_FACTOR) for term in sorted(candidates) if self.postings[term]]
+    
+    def search(self, q: str, filters: dict, offset: int, limit: int) -> tuple:
+        tokens = [strip_arabic_prefix(token) for token in search_tokens(q)]
+        size = len(self.ids)
+        if not tokens or not size:
+            return 0, []
+        
+        matched = self.alive[:size].copy()
+        for field, value in filters.items():
+            if value is not None:
+                matched &= self.filters[field][:size] == self.codes[field].get(value, -2)
+        
+        # Every query token must match; scores add up over tokens with a smoothed idf per term
+        documents = len(self.ordinals)
+        scores = np.zeros(size)
+        for token in tokens:
+            if not matched.any():
+                return 0, []
+            token_scores = np.zeros(size)
+            for term, factor in self.expand(token):
+                ordinals, weights = self.posting_array(term)
+                token_scores[ordinals] += weights * factor * math.log(1 + documents / len(ordinals))
+            matched &= token_scores > 0
+            scores += token_scores
+        
+        candidates = np.flatnonzero(matched)
+        candidate_scores = scores[candidates]
+        end = min(offset + limit, len(candidates))
+        if end <= offset:
+            return len(candidates), []
+        top = np.argpartition(-candidate_scores, end - 1)[:end] if end < len(candidates) else np.arange(len(candidates))
+        ranked = top[np.argsort(-candidate_scores[top], kind="stable")][offset:end]
+        return len(candidates), [(self.ids[candidates[i]], round(float(candidate_scores[i]), 4)) for i in ranked]
+
+search_index = SearchIndex()
+
+# Change feed
+CHANGE_FEED_FILTER_FIELDS = ["city", "type", "status"]
+
+def change_event(operation: str, item: dict, moved: bool = False) -> dict:
+    # moved marks updates that changed a field feeds filter on, so feeds the item left can drop it
+    return {"op": operation, **{field: item.get(field) for field in CHANGE_FEED_FIELDS}, "moved": moved}
+
+def log_task_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error("Background task %s failed", task.get_coro().__qualname__, exc_info=task.exception())
+
+class ChangeSubscription:
+    def __init__(self, current_user: User, type: Optional[str], city: Optional[str], status: Optional[str]):
+        self.filters = build_infrastructure_query(current_user, type, city, status)
+        self.queue = asyncio.Queue(maxsize=CHANGE_FEED_QUEUE_SIZE)
+        self.dropped = False
+    
+    def matches(self, event: dict) -> bool:
+        # Deletes without a known city still go out; an unknown id is a no-op for the client
+        if event["op"] == "delete" and event.get("city") is None:
+            return True
+        return all(event.get(field) == value for field, value in self.filters.items())
+    
+    def view(self, event: dict) -> Optional[dict]:
+        # The event as this feed sees it: an item updated out of the filter is a delete here
+        if self.matches(event):
+            return event
+        if event["op"] == "update" and event["moved"]:
+            return {**event, "op": "delete"}
+        return None
+
+# Fans one MongoDB change stream (or, without a replica set, this process's own writes) out to every open feed
+class ChangeFeed:
+    def __init__(self):
+        self.sequence = 0
+        self.recent = deque(maxlen=CHANGE_FEED_BUFFER)
+        self.subscriptions = set()
+        self.resume_token = None
+        self.source = "local"
+        self.task = None
+    
+    def event_id(self, sequence: int) -> str:
+        return f"{BOOT_ID}-{sequence}"
+    
+    def publish(self, event: dict):
+        self.sequence += 1
+        event = {**event, "seq": self.sequence}
+        self.recent.append(event)
+        for subscription in list(self.subscriptions):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A consumer this far behind has to resynchronise with a full fetch
+                subscription.dropped = True
+                self.subscriptions.discard(subscription)
+    
+    def publish_local(self, changes: List[tuple]):
+        # With a change stream every write, including tombstones for deletes, arrives through run()
+        if self.source != "local":
+            return
+        for old, new in changes:
+            if new is None:
+                self.publish(change_event("delete", old))
+            elif old is None:
+                self.publish(change_event("insert", new))
+            else:
+                moved = any(old.get(field) != new.get(field) for field in CHANGE_FEED_FILTER_FIELDS)
+                self.publish(change_event("update", new, moved))
+    
+    def subscribe(self, subscription: ChangeSubscription, last_event_id: Optional[str]) -> Optional[List[dict]]:
+        # Returns the buffered events after last_event_id, or None if the client has to refetch
+        self.subscriptions.add(subscription)
+        if not last_event_id:
+            return []
+        boot_id, _, sequence = last_event_id.partition("-")
+        if boot_id != BOOT_ID or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if self.recent and self.recent[0]["seq"] > sequence + 1:
+            return None
+        return [event for event in self.recent if event["seq"] > sequence]
+    
+    def unsubscribe(self, subscription: ChangeSubscription):
+        self.subscriptions.discard(subscription)
+    
+    def open_stream(self):
+        # Deletes are read from tombstone inserts, which still carry the id and city of the removed item
+        pipeline = [{"$match": {"$or": [
+            {"ns.coll": "infrastructure", "operationType": {"$in": ["insert", "update", "replace"]}},
+            {"ns.coll": "infrastructure_tombstones", "operationType": "insert"},
+            {"ns.coll": {"$in": CHANGE_FEED_SUMMARY_COLLECTIONS}},
+            {"to.coll": {"$in": CHANGE_FEED_SUMMARY_COLLECTIONS}}
+        ]}}]
+        return db.watch(pipeline, full_document="updateLookup", resume_after=self.resume_token)
+    
+    def handle_change(self, change: dict):
+        # Writes from other processes invalidate this process's response cache too, once the
+        # in-memory indexes have caught up so no response is cached from the old state
+        self.apply_change(change)
+        bump_collection_version("infrastructure")
+    
+    def apply_change(self, change: dict):
+        if not change.get("fullDocument") or change["ns"]["coll"] in CHANGE_FEED_SUMMARY_COLLECTIONS:
+            return
+        if change["ns"]["coll"] == "infrastructure_tombstones":
+            damage_index.remove(change["fullDocument"]["id"])
+            search_index.remove(change["fullDocument"]["id"])
+            self.publish(change_event("delete", change["fullDocument"]))
+        else:
+            damage_index.set(change["fullDocument"])
+            network_graphs.set_status(change["fullDocument"])
+            search_index.set(change["fullDocument"])
+            if change["operationType"] == "insert":
+                self.publish(change_event("insert", change["fullDocument"]))
+            else:
+                # Without pre-images the old values are unknown; replacements may have moved anything
+                updated = (change.get("updateDescription") or {}).get("updatedFields")
+                moved = updated is None or any(field in updated for field in CHANGE_FEED_FILTER_FIELDS)
+                self.publish(change_event("update", change["fullDocument"], moved))
+    
+    async def run(self):
+        while True:
+            try:
+                async with self.open_stream() as stream:
+                    self.source = "change_stream"
+                    async for change in stream:
+                        self.resume_token = stream.resume_token
+                        self.handle_change(change)
+            except PyMongoError as e:
+                # Until the stream is back, this process's own writes still reach its feeds
+                self.source = "local"
+                if isinstance(e, OperationFailure) and e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.info("Change streams need a replica set; the change feed only sees this process's writes")
+                    return
+                logger.warning("Change stream failed, resuming: %s", e)
+                await asyncio.sleep(CHANGE_FEED_RETRY_SECONDS)
+    
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        self.task.add_done_callback(log_task_failure)
+    
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+change_feed = ChangeFeed()
+
+# Tombstones let offline clients learn about deletes through /infrastructure/changes
+async def write_tombstones(changes: List[tuple]):
+    deleted_at = datetime.utcnow()
+    tombstones = [
+        {"id": old["id"], "city": old["city"], "type": old.get("type"), "deleted_at": deleted_at}
+        for old, new in changes
+        if new is None
+    ]
+    if tombstones:
+        await db.infrastructure_tombstones.insert_many(tombstones)
+
+# Write hooks
+# Derived data that is recomputed from scratch when its incremental update fails
+WRITE_HOOK_REPAIRS = {
+    "stats": rebuild_infrastructure_stats,
+    "rollups": rebuild_history_rollups,
+    "damage index": damage_index.rebuild,
+    "network graphs": network_graphs.load,
+    "search index": search_index.rebuild,
+}
+repairs_requested = set()
+repair_tasks = {}
+
+async def run_repairs(name: str):
+    # Failures that arrive while a rebuild runs may predate its reads, so they ask for one more pass
+    while name in repairs_requested:
+        repairs_requested.discard(name)
+        await WRITE_HOOK_REPAIRS[name]()
+        bump_collection_version("infrastructure")
+        logger.info("Rebuilt %s after a failed write hook", name)
+
+def write_hook_failed(name: str, error: BaseException):
+    logger.error("Write hook %s failed", name, exc_info=error)
+    if name not in WRITE_HOOK_REPAIRS:
+        return
+    repairs_requested.add(name)
+    task = repair_tasks.get(name)
+    if task is None or task.done():
+        task = asyncio.create_task(run_repairs(name))
+        task.add_done_callback(log_task_failure)
+        repair_tasks[name] = task
+
+async def record_infrastructure_changes(changes: List[tuple]):
+    # Each change is (old, new); old is None for inserts and new is None for deletes. The documents are
+    # already written, so a failing hook is logged and repaired instead of failing the request
+    bump_collection_version("infrastructure")
+    events = history_events(changes, datetime.utcnow())
+    writes = {
+        "stats": apply_stats_deltas(changes),
+        "history": insert_history(events),
+        "rollups": apply_history_rollups(events),
+        "tombstones": write_tombstones(changes),
+        "network graphs": network_graphs.apply(changes),
+    }
+    results = await asyncio.gather(*writes.values(), return_exceptions=True)
+    for name, result in zip(writes, results):
+        if isinstance(result, Exception):
+            write_hook_failed(name, result)
+    for name, apply in [("damage index", damage_index.apply), ("search index", search_index.apply), ("change feed", change_feed.publish_local)]:
+        try:
+            apply(changes)
+        except Exception as e:
+            write_hook_failed(name, e)
+    # Bumped again now that the derived data has caught up; responses built from the old stats, rollups
+    # or indexes during the writes above were cached under the first bump's version
+    bump_collection_version("infrastructure")
+
+# Bulk Import Parsing
+def detect_import_format(filename: Optional[str], requested: Optional[str]) -> str:
+    fmt = requested
+    if not fmt and filename:
+        extension = filename.rsplit(".", 1)[-1].lower()
+        fmt = {"json": "geojson", "geojson": "geojson", "ndjson": "ndjson", "jsonl": "ndjson", "csv": "csv"}.get(extension)
+    if fmt not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(IMPORT_FORMATS)}")
+    return fmt
+
+def feature_to_row(feature: dict) -> dict:
+    # Accept GeoJSON Point features as well as plain InfrastructureCreate objects
+    if not isinstance(feature, dict):
+        raise ValueError("Row must be a JSON object")
+    if feature.get("type") != "Feature":
+        return feature
+    row = dict(feature.get("properties") or {})
+    geometry = feature.get("geometry") or {}
+    if geometry.get("type") != "Point":
+        raise ValueError("Only Point geometries are supported")
+    row["coordinates"] = geometry.get("coordinates")
+    return row
+
+def iter_geojson_features(fileobj) -> Iterator[dict]:
+    # Incrementally decode the features array so the whole collection is never held in memory
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer, position, eof = "", None, False
+    
+    def read_more():
+        nonlocal buffer, eof
+        chunk = fileobj.read(IMPORT_READ_SIZE)
+        eof = not chunk
+        buffer += text_decoder.decode(chunk, final=eof)
+    
+    while position is None:
+        match = re.search(r'"features"\s*:\s*\[', buffer)
+        if match:
+            position = match.end()
+        elif eof:
+            raise ValueError("No features array found")
+        else:
+            read_more()
+    
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position >= len(buffer):
+            if eof:
+                raise ValueError("Unterminated features array")
+            buffer, position = buffer[position:], 0
+            read_more()
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            feature, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("Malformed feature")
+            buffer, position = buffer[position:], 0
+            read_more()
+            continue
+        yield feature
+        position = end
+
+def csv_row_to_item(row: dict) -> dict:
+    item = {key: (value if value != "" else None) for key, value in row.items() if key}
+    lon = item.pop("longitude", None) or item.pop("lon", None)
+    lat = item.pop("latitude", None) or item.pop("lat", None)
+    if lon is not None and lat is not None:
+        item["coordinates"] = [float(lon), float(lat)]
+    return item
+
+def iter_import_rows(fileobj, fmt: str) -> Iterator[tuple]:
+    # Yields (row_number, row) where row is a dict, or the exception raised while parsing it
+    if fmt == "geojson":
+        row_number = 0
+        for row_number, feature in enumerate(iter_geojson_features(fileobj), start=1):
+            try:
+                yield row_number, feature_to_row(feature)
+            except ValueError as e:
+                yield row_number, e
+        return
+    
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        for row_number, row in enumerate(csv.DictReader(text), start=1):
+            try:
+                yield row_number, csv_row_to_item(row)
+            except ValueError as e:
+                yield row_number, e
+        return
+    
+    for row_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield row_number, feature_to_row(json.loads(line))
+        except ValueError as e:
+            yield row_number, e
+
+def validate_import_row(row, current_user: User) -> dict:
+    if isinstance(row, Exception):
+        raise row
+    item_data = InfrastructureCreate(**row)
+    if current_user.role == "municipality" and current_user.city:
+        if item_data.city != current_user.city:
+            raise ValueError("Can only create infrastructure in your city")
+    item_dict = item_data.dict()
+    item_dict["created_by"] = current_user.id
+    return infrastructure_document(InfrastructureItem(**item_dict))
+
+def import_error(e: Exception) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors())
+    if isinstance(e, HTTPException):
+        return e.detail
+    return str(e)
+
+def prepare_import_batch(rows: Iterator[tuple], current_user: User) -> tuple:
+    # Parses and validates up to one batch; runs in a worker thread
+    docs, row_numbers, errors = [], [], []
+    while len(docs) + len(errors) < IMPORT_BATCH_SIZE:
+        try:
+            row_number, row = next(rows)
+        except StopIteration:
+            return docs, row_numbers, errors, len(docs) + len(errors), True
+        except ValueError as e:
+            # The file itself is unreadable past this point; the rows read so far are still imported
+            received = len(docs) + len(errors)
+            return docs, row_numbers, errors + [{"row": None, "error": str(e)}], received, True
+        try:
+            docs.append(validate_import_row(row, current_user))
+            row_numbers.append(row_number)
+        except (ValueError, TypeError, HTTPException) as e:
+            errors.append({"row": row_number, "error": import_error(e)})
+    return docs, row_numbers, errors, len(docs) + len(errors), False
+
+async def import_infrastructure(fileobj, fmt: str, current_user: User, progress=None) -> dict:
+    report = {"received": 0, "inserted": 0, "failed": 0, "errors": []}
+    rows = iter_import_rows(fileobj, fmt)
+    done = False
+    while not done:
+        with timed_stage("validation"):
+            docs, row_numbers, errors, received, done = await run_in_threadpool(prepare_import_batch, rows, current_user)
+        report["received"] += received
+        
+        inserted = docs
+        if docs:
+            # Stamped here rather than at validation so updated_at is close to when the batch commits
+            now = datetime.utcnow()
+            for doc in docs:
+                doc["updated_at"] = now
+            async with write_gate.shared():
+                try:
+                    await db.infrastructure.insert_many(docs, ordered=False)
+                except BulkWriteError as e:
+                    failed = {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+                    errors += [{"row": row_numbers[index], "error": message} for index, message in failed.items()]
+                    inserted = [doc for index, doc in enumerate(docs) if index not in failed]
+                if inserted:
+                    await record_infrastructure_changes([(None, doc) for doc in inserted])
+        
+        report["inserted"] += len(inserted)
+        report["failed"] += len(errors)
+        report["errors"] += errors[:IMPORT_MAX_ERRORS - len(report["errors"])]
+        if progress:
+            await progress(report)
+    
+    return report
+
+# Bulk Export Encoding
+def export_record(item: dict) -> dict:
+    return {field: item.get(field) for field in EXPORT_FIELDS}
+
+def export_frame(batch: List[dict]) -> pd.DataFrame:
+    frame = pd.DataFrame([export_record(item) for item in batch], columns=EXPORT_FIELDS)
+    for field in EXPORT_DATETIME_FIELDS:
+        frame[field] = pd.to_datetime(frame[field])
+    coordinates = [item["coordinates"] for item in batch]
+    frame["longitude"] = [point[0] for point in coordinates]
+    frame["latitude"] = [point[1] for point in coordinates]
+    return frame
+
+# Collects whatever pyarrow writes so each row group can be streamed out as soon as it is encoded
+class ChunkSink:
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+    
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self.position
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self.closed = True
+    
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+def encode_export_batch(batch: List[dict], fmt: str, first: bool, writer_state: dict) -> bytes:
+    if fmt == "ndjson":
+        return b"".join(orjson.dumps({**export_record(item), "coordinates": item["coordinates"]}) + b"\n" for item in batch)
+    if fmt == "geojson":
+        features = b",".join(orjson.dumps({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": item["coordinates"]},
+            "properties": export_record(item)
+        }) for item in batch)
+        return features if first else b"," + features
+    
+    frame = export_frame(batch)
+    if fmt == "csv":
+        return frame.to_csv(index=False, header=first, date_format="%Y-%m-%dT%H:%M:%S").encode('utf-8')
+    
+    # GeoParquet: one row group per batch, point geometries as little-endian WKB
+    frame["geometry"] = [struct.pack("<BIdd", 1, 1, lon, lat) for lon, lat in zip(frame.pop("longitude"), frame.pop("latitude"))]
+    if "writer" not in writer_state:
+        writer_state["sink"] = ChunkSink()
+        writer_state["writer"] = pq.ParquetWriter(writer_state["sink"], GEOPARQUET_SCHEMA)
+    writer_state["writer"].write_table(pa.Table.from_pandas(frame, schema=GEOPARQUET_SCHEMA, preserve_index=False))
+    return writer_state["sink"].drain()
+
+async def iter_export_chunks(query: dict, fmt: str):
+    if fmt == "geojson":
+        yield b'{"type": "FeatureCollection", "features": ['
+    
+    cursor = analytics_db.infrastructure.find(query, {"_id": 0, "location": 0}).batch_size(EXPORT_BATCH_SIZE)
+    writer_state = {}
+    first = True
+    while True:
+        batch = await cursor.to_list(EXPORT_BATCH_SIZE)
+        if not batch:
+            break
+        with timed_stage("serialization"):
+            chunk = await run_in_threadpool(encode_export_batch, batch, fmt, first, writer_state)
+        yield chunk
+        first = False
+    
+    if fmt == "geojson":
+        yield b"]}"
+    elif fmt == "csv" and first:
+        yield ",".join(EXPORT_FIELDS + ["longitude", "latitude"]).encode('utf-8') + b"\n"
+    elif fmt == "geoparquet":
+        if "writer" not in writer_state:
+            writer_state["sink"] = ChunkSink()
+            writer_state["writer"] = pq.ParquetWriter(writer_state["sink"], GEOPARQUET_SCHEMA)
+        writer_state["writer"].close()
+        yield writer_state["sink"].drain()
+
+async def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+# Background Jobs
+class JobCancelled(Exception):
+    pass
+
+# Throttled progress writes that double as the heartbeat and the cancellation check
+class JobProgress:
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.last = 0.0
+    
+    async def __call__(self, progress: dict):
+        if time.monotonic() - self.last < JOB_PROGRESS_INTERVAL_SECONDS:
+            return
+        self.last = time.monotonic()
+        job = await db.jobs.find_one_and_update(
+            {"id": self.job_id},
+            {"$set": {"progress": progress, "heartbeat_at": datetime.utcnow()}},
+            projection={"_id": 0, "cancel_requested": 1}
+        )
+        if job and job.get("cancel_requested"):
+            raise JobCancelled()
+
+async def run_export_job(job: dict, progress: JobProgress) -> dict:
+    params = job["params"]
+    query = build_infrastructure_query(
+        User(**job["user"]), params.get("type"), params.get("city"), params.get("status"),
+        params.get("bbox"), params.get("near"), params.get("radius_m")
+    )
+    media_type, extension = EXPORT_FORMATS[params["format"]]
+    filename = f"infrastructure.{extension}"
+    chunks = iter_export_chunks(query, params["format"])
+    if params.get("gzip"):
+        chunks = gzip_chunks(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+    
+    # The result file shares the job's id; a requeued job first clears what a dead worker left behind
+    try:
+        await job_files.delete(job["id"])
+    except NoFile:
+        pass
+    upload = job_files.open_upload_stream_with_id(job["id"], filename, metadata={"job_id": job["id"], "media_type": media_type})
+    size = 0
+    try:
+        async for chunk in chunks:
+            await upload.write(chunk)
+            size += len(chunk)
+            await progress({"bytes": size})
+    except BaseException:
+        await upload.abort()
+        raise
+    await upload.close()
+    return {"filename": filename, "media_type": media_type, "size": size}
+
+async def run_import_job(job: dict, progress: JobProgress) -> dict:
+    params = job["params"]
+    # The importer parses in a worker thread and needs a plain file object
+    with tempfile.SpooledTemporaryFile(max_size=JOB_SPOOL_BYTES) as spool:
+        download = await job_files.open_download_stream(params["file_id"])
+        while chunk := await download.readchunk():
+            spool.write(chunk)
+        spool.seek(0)
+        report = await import_infrastructure(
+            spool, params["format"], User(**job["user"]),
+            progress=lambda report: progress({key: report[key] for key in ("received", "inserted", "failed")})
+        )
+    await job_files.delete(params["file_id"])
+    return report
+
+async def run_rebuild_stats_job(job: dict, progress: JobProgress) -> dict:
+    await rebuild_infrastructure_stats()
+    await rebuild_history_rollups()
+    bump_collection_version("infrastructure")
+    return {"rebuilt_at": datetime.utcnow()}
+
+JOB_HANDLERS = {
+    "export": run_export_job,
+    "import": run_import_job,
+    "rebuild_stats": run_rebuild_stats_job,
+}
+
+class JobRunner:
+    def __init__(self):
+        self.workers = []
+        self.running = {}
+        self.slot_roles = set()
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+    
+    def notify(self):
+        self.wakeup.set()
+    
+    async def ensure_slots(self, role: str):
+        if role in self.slot_roles:
+            return
+        for slot in range(JOB_ROLE_LIMITS.get(role, 1)):
+            try:
+                await db.job_slots.update_one({"role": role, "slot": slot}, {"$setOnInsert": {"job_id": None}}, upsert=True)
+            except DuplicateKeyError:
+                # Another worker created it first
+                pass
+        self.slot_roles.add(role)
+    
+    async def acquire_slot(self, job: dict) -> bool:
+        # A slot row holds at most one job, so this single update is what enforces the role limit
+        await self.ensure_slots(job["role"])
+        slot = await db.job_slots.find_one_and_update(
+            {"role": job["role"], "slot": {"$lt": JOB_ROLE_LIMITS.get(job["role"], 1)}, "job_id": None},
+            {"$set": {"job_id": job["id"]}}
+        )
+        return slot is not None
+    
+    async def release_slot(self, job_id: str):
+        await db.job_slots.update_many({"job_id": job_id}, {"$set": {"job_id": None}})
+    
+    async def claim(self) -> Optional[dict]:
+        # Roles without a free slot are skipped so other roles' jobs still start. The slot is taken
+        # after claiming; a worker that loses the race for the last one puts the job back in the queue
+        free = set(await db.job_slots.distinct("role", {"job_id": None}))
+        full = list(set(await db.job_slots.distinct("role")) - free)
+        now = datetime.utcnow()
+        claimed = {"status": "running", "started_at": now, "heartbeat_at": now, "worker": BOOT_ID}
+        job = await db.jobs.find_one_and_update(
+            {"status": "queued", "role": {"$nin": full}},
+            {"$set": claimed},
+            sort=[("created_at", 1)],
+            projection={"_id": 0}
+        )
+        if job is None:
+            return None
+        job = {**job, **claimed}
+        if await self.acquire_slot(job):
+            return job
+        await db.jobs.update_one(
+            {"id": job["id"], "status": "running"},
+            {"$set": {"status": "queued", "started_at": None, "heartbeat_at": None, "worker": None}}
+        )
+        return None
+    
+    async def work(self):
+        while True:
+            try:
+                job = await self.claim()
+            except PyMongoError as e:
+                logger.warning("Could not claim a job: %s", e)
+                job = None
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            # The job runs as its own task so cancelling it leaves this loop alive
+            task = asyncio.create_task(self.execute(job))
+            self.running[job["id"]] = task
+            try:
+                await asyncio.wait([task])
+            finally:
+                self.running.pop(job["id"], None)
+    
+    async def heartbeat(self, job_id: str):
+        # Keeps jobs that report no progress, such as stats rebuilds, from looking orphaned
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                await db.jobs.update_one({"id": job_id, "status": "running"}, {"$set": {"heartbeat_at": datetime.utcnow()}})
+            except PyMongoError as e:
+                logger.warning("Could not record heartbeat of job %s: %s", job_id, e)
+    
+    async def execute(self, job: dict):
+        update = {}
+        heartbeat = asyncio.create_task(self.heartbeat(job["id"]))
+        try:
+            result = await JOB_HANDLERS[job["kind"]](job, JobProgress(job["id"]))
+            update = {"status": "succeeded", "result": result}
+        except (JobCancelled, asyncio.CancelledError):
+            if self.stopping:
+                # Shutting down, not cancelled: hand the job to the next worker
+                update = {"status": "queued", "started_at": None, "progress": {}}
+            else:
+                update = {"status": "cancelled"}
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job["id"], job["kind"])
+            update = {"status": "failed", "error": str(e)}
+        finally:
+            heartbeat.cancel()
+        if update["status"] != "queued":
+            update["finished_at"] = datetime.utcnow()
+        await self.finish(job["id"], update)
+    
+    async def finish(self, job_id: str, update: dict):
+        # A lost status write would leave the job running until recovery requeues it, so ride out brief outages
+        for attempt in range(JOB_FINISH_ATTEMPTS):
+            try:
+                await db.jobs.update_one({"id": job_id}, {"$set": update})
+                await self.release_slot(job_id)
+                return
+            except PyMongoError as e:
+                logger.warning("Could not record the outcome of job %s: %s", job_id, e)
+                await asyncio.sleep(2 ** attempt)
+        logger.error("Gave up recording the outcome of job %s; recovery will requeue it", job_id)
+    
+    def cancel_local(self, job_id: str):
+        task = self.running.get(job_id)
+        if task:
+            task.cancel()
+    
+    async def recover(self):
+        # Requeue running jobs whose process died, then free slots held by jobs that are no longer running
+        stale = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        result = await db.jobs.update_many(
+            {"status": "running", "heartbeat_at": {"$lt": stale}},
+            {"$set": {"status": "queued", "started_at": None, "progress": {}}}
+        )
+        if result.modified_count:
+            logger.info("Requeued %d orphaned jobs", result.modified_count)
+        held = await db.job_slots.distinct("job_id", {"job_id": {"$ne": None}})
+        running = set(await db.jobs.distinct("id", {"id": {"$in": held}, "status": "running"}))
+        leaked = [job_id for job_id in held if job_id not in running]
+        if leaked:
+            await db.job_slots.update_many({"job_id": {"$in": leaked}}, {"$set": {"job_id": None}})
+    
+    async def purge(self):
+        cutoff = datetime.utcnow() - timedelta(days=JOB_RETENTION_DAYS)
+        expired = await db.jobs.find({"finished_at": {"$lt": cutoff}}, {"_id": 0, "id": 1, "params": 1}).to_list(None)
+        for job in expired:
+            for file_id in (job["id"], job["params"].get("file_id")):
+                try:
+                    await job_files.delete(file_id)
+                except NoFile:
+                    pass
+        if expired:
+            await db.jobs.delete_many({"id": {"$in": [job["id"] for job in expired]}})
+    
+    async def every(self, seconds: float, action):
+        while True:
+            try:
+                await action()
+            except PyMongoError as e:
+                logger.warning("Job maintenance %s failed: %s", action.__name__, e)
+            await asyncio.sleep(seconds)
+    
+    async def start(self):
+        if not JOB_WORKERS:
+            return
+        await self.recover()
+        self.workers = [asyncio.create_task(self.work()) for _ in range(JOB_WORKERS)]
+        self.workers.append(asyncio.create_task(self.every(JOB_RECOVERY_INTERVAL_SECONDS, self.recover)))
+        self.workers.append(asyncio.create_task(self.every(JOB_PURGE_INTERVAL_SECONDS, self.purge)))
+        for worker in self.workers:
+            worker.add_done_callback(log_task_failure)
+    
+    async def stop(self):
+        self.stopping = True
+        for worker in self.workers:
+            worker.cancel()
+        tasks = list(self.running.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks, timeout=10)
+
+job_runner = JobRunner()
+
+# Vector Tile Encoding (Mapbox Vector Tile 2.1, point geometries only)
+def pb_varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def pb_key(field_number: int, wire_type: int) -> bytes:
+    return pb_varint((field_number << 3) | wire_type)
+
+def pb_bytes(field_number: int, payload: bytes) -> bytes:
+    return pb_key(field_number, 2) + pb_varint(len(payload)) + payload
+
+def pb_packed(field_number: int, values: List[int]) -> bytes:
+    return pb_bytes(field_number, b"".join(pb_varint(value) for value in values))
+
+def zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 31)
+
+def mvt_value(value) -> bytes:
+    if isinstance(value, bool):
+        return pb_key(7, 0) + pb_varint(int(value))
+    if isinstance(value, int):
+        return pb_key(6, 0) + pb_varint((value << 1) ^ (value >> 63))
+    if isinstance(value, float):
+        return pb_key(3, 1) + struct.pack("<d", value)
+    return pb_bytes(1, str(value).encode('utf-8'))
+
+def tile_bounds(z: int, x: int, y: int) -> List[float]:
+    n = 2 ** z
+    def lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+    return [x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)]
+
+def tile_pixel(lon: float, lat: float, z: int, x: int, y: int) -> tuple:
+    n = 2 ** z
+    lat_rad = math.radians(max(min(lat, 85.0511), -85.0511))
+    world_x = (lon + 180) / 360 * n
+    world_y = (1 - math.asinh(math.tan(lat_rad)) / math.pi) / 2 * n
+    # Floor rather than truncate so points just west or north of the tile land at -1 and are dropped
+    return math.floor((world_x - x) * MVT_EXTENT), math.floor((world_y - y) * MVT_EXTENT)
+
+def tile_properties(z: int) -> List[str]:
+    properties = MVT_PROPERTIES[0][1]
+    for min_zoom, names in MVT_PROPERTIES:
+        if z >= min_zoom:
+            properties = names
+    return properties
+
+def encode_mvt_layer(items: List[dict], z: int, x: int, y: int) -> bytes:
+    properties = tile_properties(z)
+    keys, values = {}, {}
+    features = []
+    for item in items:
+        px, py = tile_pixel(item["coordinates"][0], item["coordinates"][1], z, x, y)
+        # The query is padded, so drop points that fall in a neighbouring tile
+        if not (0 <= px < MVT_EXTENT and 0 <= py < MVT_EXTENT):
+            continue
+        tags = []
+        for name in properties:
+            value = item.get(name)
+            if value is None:
+                continue
+            tags.append(keys.setdefault(name, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        geometry = [(1 & 0x7) | (1 << 3), zigzag(px), zigzag(py)]  # MoveTo(1)
+        feature = pb_packed(2, tags) + pb_key(3, 0) + pb_varint(1) + pb_packed(4, geometry)
+        features.append(pb_bytes(2, feature))
+    
+    layer = pb_key(15, 0) + pb_varint(2) + pb_bytes(1, MVT_LAYER_NAME.encode('utf-8'))
+    layer += b"".join(features)
+    layer += b"".join(pb_bytes(3, key.encode('utf-8')) for key in keys)
+    layer += b"".join(pb_bytes(4, mvt_value(value)) for _, value in values)
+    layer += pb_key(5, 0) + pb_varint(MVT_EXTENT)
+    return pb_bytes(3, layer)
+
+# Infrastructure Routes
+@api_router.get("/infrastructure", response_model=List[InfrastructureItem])
+async def get_infrastructure(
+    request: Request,
+    type: Optional[str] = None,
+    city: Optional[str] = None,
+    status: Optional[str] = None,
+    bbox: Optional[str] = None,
+    near: Optional[str] = None,
+    radius_m: Optional[float] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(INFRASTRUCTURE_PAGE_SIZE, ge=1, le=INFRASTRUCTURE_MAX_PAGE_SIZE),
+    stream: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    query = build_infrastructure_query(current_user, type, city, status, bbox, near, radius_m)
+    if cursor:
+        query = {"$and": [query, decode_cursor(cursor)]}
+    # id and updated_at are always sent because the pagination cursor is built from them
+    projection = infrastructure_projection(parse_fields(fields, INFRASTRUCTURE_FIELDS, ["id", "updated_at"]))
+    
+    # NDJSON mode sends the whole result set, one document per line, as the cursor yields batches
+    if stream:
+        return StreamingResponse(stream_infrastructure_ndjson(query, projection), media_type="application/x-ndjson")
+    
+    async def build():
+        # Fetch one extra item to know whether another page follows
+        items = await db.infrastructure.find(query, projection).sort(INFRASTRUCTURE_SORT).limit(limit + 1).to_list(limit + 1)
+        headers = {}
+        if len(items) > limit:
+            items = items[:limit]
+            headers["X-Next-Cursor"] = encode_cursor(items[-1])
+        return items, headers
+    
+    # Documents were validated on write; returning a Response skips response_model validation
+    return await cached_json_response(request, {"route": "list", "query": query, "projection": projection, "limit": limit}, build)
+
+@api_router.post("/infrastructure", response_model=InfrastructureItem)
+async def create_infrastructure(
+    item_data: InfrastructureCreate,
+    current_user: User = Depends(get_current_user)
+):
+    # Role-based validation
+    if current_user.role == "municipality" and current_user.city:
+        if item_data.city != current_user.city:
+            raise HTTPException(status_code=403, detail="Can only create infrastructure in your city")
+    
+    item_dict = item_data.dict()
+    item_dict["created_by"] = current_user.id
+    item_obj = InfrastructureItem(**item_dict)
+    
+    item_doc = infrastructure_document(item_obj)
+    async with write_gate.shared():
+        await db.infrastructure.insert_one(item_doc)
+        await record_infrastructure_changes([(None, item_doc)])
+    return item_obj
+
+@api_router.post("/infrastructure/bulk")
+async def bulk_import_infrastructure(
+    file: UploadFile = File(...),
+    format: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    fmt = detect_import_format(file.filename, format)
+    return await import_infrastructure(file.file, fmt, current_user)
+
+@api_router.put("/infrastructure/{item_id}", response_model=InfrastructureItem)
+async def update_infrastructure(
+    item_id: str,
+    update_data: InfrastructureUpdate,
+    current_user: User = Depends(get_current_user)
+):
+    update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
+    update_dict["updated_at"] = datetime.utcnow()
+    
+    # Role-based validation happens in the filter, so the update is a single round trip
+    query = {"id": item_id}
+    if current_user.role == "municipality" and current_user.city:
+        query["city"] = current_user.city
+    
+    # The previous values are needed for the summary deltas; the new document is derived from them
+    async with write_gate.shared():
+        item = await db.infrastructure.find_one_and_update(
+            query, {"$set": update_dict}, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+        )
+        if item:
+            updated_item = {**item, **update_dict}
+            await record_infrastructure_changes([(item, updated_item)])
+    if not item:
+        if "city" in query and await db.infrastructure.find_one({"id": item_id}, {"_id": 1}):
+            raise HTTPException(status_code=403, detail="Can only update infrastructure in your city")
+        raise HTTPException(status_code=404, detail="Infrastructure item not found")
+    
+    return InfrastructureItem(**updated_item)
+
+def batch_query(current_user: User, batch_filter: InfrastructureBatchFilter) -> dict:
+    query = build_infrastructure_query(current_user, batch_filter.type, batch_filter.city, batch_filter.status, batch_filter.bbox)
+    if batch_filter.ids is not None:
+        query["id"] = {"$in": batch_filter.ids}
+    # The role scope alone never counts as a filter
+    if not (batch_filter.ids is not None or batch_filter.bbox or batch_filter.city or batch_filter.type or batch_filter.status):
+        raise HTTPException(status_code=400, detail="filter needs at least one of ids, bbox, city, type or status")
+    return query
+
+async def find_batch_ids(query: dict) -> List[str]:
+    items = await db.infrastructure.find(query, {"_id": 0, "id": 1}).to_list(BATCH_MAX_ITEMS + 1)
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Filter matches more than {BATCH_MAX_ITEMS} items")
+    return [item["id"] for item in items]
+
+async def write_batch_items(ids: List[str], write) -> List[dict]:
+    # One find-and-modify per item returns its exact previous version, so changes are only recorded for
+    # writes that happened, even if another request moved or removed the item after the ids were read
+    semaphore = asyncio.Semaphore(BATCH_WRITE_CONCURRENCY)
+    async def run(item_id: str):
+        async with semaphore:
+            return await write(item_id)
+    return [item for item in await asyncio.gather(*(run(item_id) for item_id in ids)) if item]
+
+@api_router.patch("/infrastructure")
+async def batch_update_infrastructure(
+    batch: InfrastructureBatchUpdate,
+    current_user: User = Depends(get_current_user)
+):
+    if batch.items is not None:
+        updates = {
+            entry.id: {k: v for k, v in entry.dict(exclude={"id"}).items() if v is not None}
+            for entry in batch.items
+        }
+        query = build_infrastructure_query(current_user)
+        query["id"] = {"$in": list(updates)}
+    elif batch.filter and batch.update:
+        query = batch_query(current_user, batch.filter)
+        update_dict = {k: v for k, v in batch.update.dict().items() if v is not None}
+    else:
+        raise HTTPException(status_code=400, detail="Provide either filter and update, or items")
+    
+    ids = await find_batch_ids(query)
+    if not ids:
+        return {"matched": 0, "modified": 0}
+    
+    # Stamped after the read so updated_at is as close as possible to when the write commits
+    now = datetime.utcnow()
+    if batch.items is not None:
+        updates = {item_id: {**update, "updated_at": now} for item_id, update in updates.items()}
+    else:
+        update_dict["updated_at"] = now
+    
+    # Each item is re-checked against the filter as it is written, so the summary deltas match what changed
+    def item_update(item_id: str) -> dict:
+        return updates[item_id] if batch.items is not None else update_dict
+    
+    async with write_gate.shared():
+        items = await write_batch_items(ids, lambda item_id: db.infrastructure.find_one_and_update(
+            {**query, "id": item_id}, {"$set": item_update(item_id)}, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+        ))
+        if items:
+            await record_infrastructure_changes([(item, {**item, **item_update(item["id"])}) for item in items])
+    # updated_at is always set, so every matched item is modified
+    return {"matched": len(items), "modified": len(items)}
+
+@api_router.delete("/infrastructure")
+async def batch_delete_infrastructure(
+    batch_filter: InfrastructureBatchFilter,
+    current_user: User = Depends(get_current_user)
+):
+    query = batch_query(current_user, batch_filter)
+    ids = await find_batch_ids(query)
+    if not ids:
+        return {"deleted": 0}
+    
+    async with write_gate.shared():
+        items = await write_batch_items(ids, lambda item_id: db.infrastructure.find_one_and_delete({**query, "id": item_id}, projection={"_id": 0}))
+        if items:
+            await record_infrastructure_changes([(item, None) for item in items])
+    return {"deleted": len(items)}
+
+@api_router.delete("/infrastructure/{item_id}")
+async def delete_infrastructure(
+    item_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    item = await db.infrastructure.find_one({"id": item_id})
+    if not item:
+        raise HTTPException(status_code=404, detail="Infrastructure item not found")
+    
+    # Role-based validation
+    if current_user.role == "municipality":
+        if current_user.city and item["city"] != current_user.city:
+            raise HTTPException(status_code=403, detail="Can only delete infrastructure in your city")
+    
+    # A concurrent delete may have won since the read, and only the request that removed the item records it;
+    # matching the city read above keeps the role check valid if the item moved meanwhile
+    async with write_gate.shared():
+        item = await db.infrastructure.find_one_and_delete({"id": item_id, "city": item["city"]}, projection={"_id": 0})
+        if item:
+            await record_infrastructure_changes([(item, None)])
+    if not item:
+        raise HTTPException(status_code=404, detail="Infrastructure item not found")
+    return {"message": "Infrastructure item deleted successfully"}
+
+# Streaming export of filtered inventories
+@api_router.get("/infrastructure/export")
+async def export_infrastructure(
+    format: str = "geojson",
+    gzip: bool = False,
+    type: Optional[str] = None,
+    city: Optional[str] = None,
+    status: Optional[str] = None,
+    bbox: Optional[str] = None,
+    near: Optional[str] = None,
+    radius_m: Optional[float] = None,
+    current_user: User = Depends(get_current_user)
+):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    
+    query = build_infrastructure_query(current_user, type, city, status, bbox, near, radius_m)
+    media_type, extension = EXPORT_FORMATS[format]
+    chunks = iter_export_chunks(query, format)
+    filename = f"infrastructure.{extension}"
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+    
+    return StreamingResponse(chunks, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    })
+
+# Delta sync for offline clients
+@api_router.get("/infrastructure/changes")
+async def get_infrastructure_changes(
+    since: Optional[datetime] = None,
+    type: Optional[str] = None,
+    city: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=INFRASTRUCTURE_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user)
+):
+    # Stored timestamps are naive UTC
+    if since and since.tzinfo:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    since = since or datetime.min
+    read_at = datetime.utcnow()
+    
+    # Tombstones older than the retention window are gone, so such clients must start over
+    if since != datetime.min and since < datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+        return {"reset": True, "upserts": [], "deletes": [], "high_water_mark": None, "next_cursor": None}
+    
+    scope = build_infrastructure_query(current_user, type, city)
+    query = {**scope, "updated_at": {"$gt": since}}
+    if cursor:
+        query = {"$and": [query, decode_cursor(cursor)]}
+    
+    projection = infrastructure_projection(INFRASTRUCTURE_FIELDS)
+    upserts = await db.infrastructure.find(query, projection).sort(INFRASTRUCTURE_SORT).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(upserts) > limit:
+        upserts = upserts[:limit]
+        next_cursor = encode_cursor(upserts[-1])
+    
+    # Deletes are sent once, on the first page
+    tombstone_query = {**scope, "deleted_at": {"$gt": since}}
+    deletes = []
+    if not cursor:
+        deletes = await db.infrastructure_tombstones.find(tombstone_query, {"_id": 0, "id": 1, "deleted_at": 1}).sort("deleted_at", 1).to_list(None)
+    
+    # The high-water mark is only final once the last page has been read
+    high_water_mark = None
+    if next_cursor is None:
+        latest_tombstone = await db.infrastructure_tombstones.find_one(tombstone_query, sort=[("deleted_at", -1)])
+        candidates = [since]
+        if upserts:
+            candidates.append(upserts[-1]["updated_at"])
+        if latest_tombstone:
+            candidates.append(latest_tombstone["deleted_at"])
+        high_water_mark = max(since, min(max(candidates), read_at - timedelta(seconds=SYNC_SAFETY_WINDOW_SECONDS)))
+        if high_water_mark == datetime.min:
+            high_water_mark = None
+    
+    return ORJSONResponse({
+        "reset": False,
+        "upserts": upserts,
+        "deletes": deletes,
+        "high_water_mark": high_water_mark,
+        "next_cursor": next_cursor
+    })
+
+# Server-sent change feed
+@api_router.get("/infrastructure/stream")
+async def stream_infrastructure_changes(
+    request: Request,
+    type: Optional[str] = None,
+    city: Optional[str] = None,
+    status: Optional[str] = None,
+    current_user: User = Depends(get_stream_user)
+):
+    subscription = ChangeSubscription(current_user, type, city, status)
+    backlog = change_feed.subscribe(subscription, request.headers.get("last-event-id"))
+    
+    def message(event: dict) -> bytes:
+        data = orjson.dumps({key: value for key, value in event.items() if key not in ("seq", "moved")})
+        return f"id: {change_feed.event_id(event['seq'])}\nevent: {event['op']}\ndata: ".encode('utf-8') + data + b"\n\n"
+    
+    async def events():
+        try:
+            # The buffer no longer reaches back to the client's last event, so it must refetch
+            if backlog is None:
+                yield f"id: {change_feed.event_id(change_feed.sequence)}\nevent: reset\ndata: {{}}\n\n".encode('utf-8')
+            for event in backlog or []:
+                event = subscription.view(event)
+                if event:
+                    yield message(event)
+            
+            while not subscription.dropped:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), CHANGE_FEED_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield b": keep-alive\n\n"
+                    continue
+                event = subscription.view(event)
+                if event:
+                    yield message(event)
+            
+            yield b"event: reset\ndata: {}\n\n"
+        finally:
+            change_feed.unsubscribe(subscription)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+# Ranked search endpoint
+@api_router.get("/infrastructure/search")
+async def search_infrastructure(
+    q: str = Query(..., min_length=1),
+    city: Optional[str] = None,
+    type: Optional[str] = None,
+    status: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user)
+):
+    # Ranked over name, district and description with Arabic normalization, prefix and typo matching
+    if current_user.role == "municipality" and current_user.city:
+        city = current_user.city
+    total, hits = search_index.search(q, {"city": city, "type": type, "status": status}, offset, limit)
+    
+    scores = dict(hits)
+    ranks = {item_id: rank for rank, (item_id, _) in enumerate(hits)}
+    items = await db.infrastructure.find(
+        {"id": {"$in": list(scores)}}, infrastructure_projection(INFRASTRUCTURE_FIELDS)
+    ).to_list(len(scores))
+    items.sort(key=lambda item: ranks[item["id"]])
+    return ORJSONResponse({
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "items": [{**item, "score": scores[item["id"]]} for item in items]
+    })
+
+# GeoJSON endpoint for map visualization
+@api_router.get("/infrastructure/geojson")
+async def get_infrastructure_geojson(
+    request: Request,
+    type: Optional[str] = None,
+    city: Optional[str] = None,
+    status: Optional[str] = None,
+    bbox: Optional[str] = None,
+    near: Optional[str] = None,
+    radius_m: Optional[float] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    query = build_infrastructure_query(current_user, type, city, status, bbox, near, radius_m)
+    
+    properties = parse_fields(fields, GEOJSON_PROPERTIES, ["id"])
+    projection = infrastructure_projection(properties + ["coordinates"])
+    
+    async def build():
+        items = await analytics_primary_db.infrastructure.find(query, projection).to_list(1000)
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": item["coordinates"]},
+                "properties": {name: item.get(name) for name in properties}
+            }
+            for item in items
+        ]
+        return {"type": "FeatureCollection", "features": features}, {}
+    
+    return await cached_json_response(request, {"route": "geojson", "query": query, "projection": projection}, build)
+
+# Cluster endpoint for zoomed-out map views
+@api_router.get("/infrastructure/clusters")
+async def get_infrastructure_clusters(
+    zoom: int = Query(..., ge=0, le=MAX_ZOOM),
+    bbox: Optional[str] = None,
+    type: Optional[str] = None,
+    city: Optional[str] = None,
+    status: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    query = build_infrastructure_query(current_user, type, city, status, bbox)
+    cell_size = 360 / (2 ** zoom) / CLUSTER_CELLS_PER_TILE
+    
+    # Bucket by grid cell, type and status so the result size depends on the viewport, not the asset count
+    pipeline = [
+        {"$match": query},
+        {"$project": {
+            "id": 1,
+            "type": 1,
+            "status": 1,
+            "lon": {"$arrayElemAt": ["$coordinates", 0]},
+            "lat": {"$arrayElemAt": ["$coordinates", 1]}
+        }},
+        {"$group": {
+            "_id": {
+                "x": {"$floor": {"$divide": ["$lon", cell_size]}},
+                "y": {"$floor": {"$divide": ["$lat", cell_size]}},
+                "type": "$type",
+                "status": "$status"
+            },
+            "count": {"$sum": 1},
+            "lon": {"$sum": "$lon"},
+            "lat": {"$sum": "$lat"},
+            "item_id": {"$first": "$id"}
+        }}
+    ]
+    buckets = await db.infrastructure.aggregate(pipeline).to_list(None)
+    
+    cells = {}
+    for bucket in buckets:
+        key = (bucket["_id"]["x"], bucket["_id"]["y"])
+        cell = cells.setdefault(key, {"count": 0, "lon": 0.0, "lat": 0.0, "types": {}, "statuses": {}, "item_id": None})
+        cell["count"] += bucket["count"]
+        cell["lon"] += bucket["lon"]
+        cell["lat"] += bucket["lat"]
+        cell["item_id"] = bucket["item_id"]
+        item_type, item_status = bucket["_id"]["type"], bucket["_id"]["status"]
+        cell["types"][item_type] = cell["types"].get(item_type, 0) + bucket["count"]
+        cell["statuses"][item_status] = cell["statuses"].get(item_status, 0) + bucket["count"]
+    
+    clusters = []
+    for cell in cells.values():
+        cluster = {
+            "coordinates": [cell["lon"] / cell["count"], cell["lat"] / cell["count"]],
+            "count": cell["count"],
+            "types": cell["types"],
+            "statuses": cell["statuses"]
+        }
+        # A single-asset cluster can be drawn as a regular marker
+        if cell["count"] == 1:
+            cluster["id"] = cell["item_id"]
+        clusters.append(cluster)
+    
+    return {"zoom": zoom, "cell_size": cell_size, "clusters": clusters}
+
+# Vector tile endpoint for the infrastructure layer
+@api_router.get("/tiles/{z}/{x}/{y}.mvt")
+async def get_infrastructure_tile(
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    type: Optional[str] = None,
+    city: Optional[str] = None,
+    status: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    if not (0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    
+    query = build_infrastructure_query(current_user, type, city, status)
+    etag = collection_etag("infrastructure", {"tile": [z, x, y], "query": query})
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    body = response_cache.get(etag)
+    if body is None:
+        min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y)
+        if z >= MVT_MIN_QUERY_ZOOM:
+            # Pad by half a tile so geodesic polygon edges never cut off points near the border
+            pad_lon, pad_lat = (max_lon - min_lon) / 2, (max_lat - min_lat) / 2
+            padded = [max(min_lon - pad_lon, -180.0), max(min_lat - pad_lat, -90.0),
+                      min(max_lon + pad_lon, 180.0), min(max_lat + pad_lat, 90.0)]
+            tile_filter = bbox_filter(padded)
+        else:
+            # Tile edges are meridians and parallels, so a coordinate range is exact; edge rows also
+            # take the poles, which tile_pixel clamps onto the map
+            tile_filter = {
+                "coordinates.0": {"$gte": min_lon, "$lte": max_lon},
+                "coordinates.1": {"$gte": min_lat if y < 2 ** z - 1 else -90.0, "$lte": max_lat if y > 0 else 90.0},
+            }
+        projection = {"_id": 0, "coordinates": 1, **{name: 1 for name in tile_properties(z)}}
+        items = await db.infrastructure.find({"$and": [query, tile_filter]}, projection).to_list(None)
+        body = encode_mvt_layer(items, z, x, y)
+        response_cache.set(etag, body)
+    
+    return Response(content=body, media_type=MVT_MEDIA_TYPE, headers=headers)
+
+# Network Routes
+async def find_network_asset(item_id: str, current_user: User) -> dict:
+    item = await db.infrastructure.find_one({"id": item_id}, {"_id": 0, "id": 1, "type": 1, "city": 1, "status": 1, "coordinates": 1})
+    if not item:
+        raise HTTPException(status_code=404, detail="Infrastructure item not found")
+    if current_user.role == "municipality" and current_user.city and item["city"] != current_user.city:
+        raise HTTPException(status_code=403, detail="Can only access infrastructure in your city")
+    return item
+
+@api_router.post("/network/links", response_model=NetworkLink)
+async def create_network_link(link_data: NetworkLinkCreate, current_user: User = Depends(get_current_user)):
+    if link_data.from_id == link_data.to_id:
+        raise HTTPException(status_code=400, detail="A link needs two different assets")
+    source = await find_network_asset(link_data.from_id, current_user)
+    target = await find_network_asset(link_data.to_id, current_user)
+    if source["city"] != target["city"] or source["type"] != target["type"]:
+        raise HTTPException(status_code=400, detail="Links must join assets of the same type in the same city")
+    
+    length_m = link_data.length_m if link_data.length_m is not None else distance_m(source["coordinates"], target["coordinates"])
+    link = NetworkLink(
+        from_id=source["id"], to_id=target["id"], city=source["city"], type=source["type"],
+        length_m=length_m, created_by=current_user.id
+    )
+    try:
+        await db.infrastructure_links.insert_one(link.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="These assets are already linked")
+    network_graphs.add_link(link.dict(), {item["id"]: in_service(item) for item in (source, target)})
+    return link
+
+@api_router.get("/network/links", response_model=List[NetworkLink])
+async def get_network_links(
+    city: Optional[str] = None,
+    type: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    query = {}
+    if current_user.role == "municipality" and current_user.city:
+        query["city"] = current_user.city
+    elif city:
+        query["city"] = city
+    if type:
+        query["type"] = type
+    return await db.infrastructure_links.find(query, {"_id": 0}).to_list(None)
+
+@api_router.delete("/network/links/{link_id}")
+async def delete_network_link(link_id: str, current_user: User = Depends(get_current_user)):
+    link = await db.infrastructure_links.find_one({"id": link_id}, {"_id": 0})
+    if not link:
+        raise HTTPException(status_code=404, detail="Link not found")
+    if current_user.role == "municipality" and current_user.city and link["city"] != current_user.city:
+        raise HTTPException(status_code=403, detail="Can only delete links in your city")
+    
+    await db.infrastructure_links.delete_one({"id": link_id})
+    network_graphs.remove_link(link)
+    return {"message": "Link deleted successfully"}
+
+@api_router.get("/network/downstream/{item_id}")
+async def get_downstream_assets(item_id: str, current_user: User = Depends(get_current_user)):
+    # Which assets lose service if this one is damaged
+    item = await find_network_asset(item_id, current_user)
+    affected = network_graphs.city(item["city"]).downstream(item_id)
+    return {"item_id": item_id, "affected": affected, "count": len(affected)}
+
+@api_router.get("/network/route")
+async def get_network_route(
+    from_id: str,
+    to_id: str,
+    avoid_out_of_service: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    source = await find_network_asset(from_id, current_user)
+    target = await find_network_asset(to_id, current_user)
+    if source["city"] != target["city"]:
+        raise HTTPException(status_code=400, detail="Assets are in different cities")
+    
+    route = network_graphs.city(source["city"]).route(from_id, to_id, avoid_out_of_service)
+    if route is None:
+        raise HTTPException(status_code=404, detail="No network path between these assets")
+    return route
+
+# Job Routes
+async def submit_job(kind: str, params: dict, current_user: User, job_id: Optional[str] = None) -> Job:
+    await check_job_quota(current_user)
+    job = Job(kind=kind, params=params, user_id=current_user.id, role=current_user.role)
+    if job_id:
+        job.id = job_id
+    # The submitter is kept so the job runs with the same role scope as the request would have
+    await db.jobs.insert_one({**job.dict(), "user": current_user.dict()})
+    job_runner.notify()
+    return job
+
+async def check_job_quota(current_user: User):
+    active = await db.jobs.count_documents({"user_id": current_user.id, "status": {"$in": ["queued", "running"]}})
+    if active >= JOB_MAX_ACTIVE_PER_USER:
+        raise HTTPException(status_code=429, detail=f"At most {JOB_MAX_ACTIVE_PER_USER} jobs can be queued or running per user")
+
+async def find_job(job_id: str, current_user: User) -> dict:
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0, "user": 0})
+    if not job or (job["user_id"] != current_user.id and current_user.role != "ministry"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@api_router.post("/jobs/export", response_model=Job, status_code=202)
+async def submit_export_job(
+    format: str = "geojson",
+    gzip: bool = False,
+    type: Optional[str] = None,
+    city: Optional[str] = None,
+    status: Optional[str] = None,
+    bbox: Optional[str] = None,
+    near: Optional[str] = None,
+    radius_m: Optional[float] = None,
+    current_user: User = Depends(get_current_user)
+):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    # Reject bad filters now rather than in the worker
+    build_infrastructure_query(current_user, type, city, status, bbox, near, radius_m)
+    params = {"format": format, "gzip": gzip, "type": type, "city": city, "status": status, "bbox": bbox, "near": near, "radius_m": radius_m}
+    return await submit_job("export", params, current_user)
+
+@api_router.post("/jobs/import", response_model=Job, status_code=202)
+async def submit_import_job(
+    file: UploadFile = File(...),
+    format: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    fmt = detect_import_format(file.filename, format)
+    await check_job_quota(current_user)
+    
+    job_id = str(uuid.uuid4())
+    file_id = f"{job_id}:upload"
+    upload = job_files.open_upload_stream_with_id(file_id, file.filename or "upload", metadata={"job_id": job_id})
+    while chunk := await file.read(IMPORT_READ_SIZE):
+        await upload.write(chunk)
+    await upload.close()
+    return await submit_job("import", {"file_id": file_id, "format": fmt, "filename": file.filename}, current_user, job_id)
+
+@api_router.post("/jobs/rebuild-stats", response_model=Job, status_code=202)
+async def submit_rebuild_stats_job(current_user: User = Depends(get_current_user)):
+    if current_user.role != "ministry":
+        raise HTTPException(status_code=403, detail="Only ministry users can rebuild analytics")
+    return await submit_job("rebuild_stats", {}, current_user)
+
+@api_router.get("/jobs", response_model=List[Job])
+async def get_jobs(
+    status: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_user)
+):
+    query = {} if current_user.role == "ministry" else {"user_id": current_user.id}
+    if status:
+        query["status"] = status
+    return await db.jobs.find(query, {"_id": 0, "user": 0}).sort("created_at", -1).to_list(limit)
+
+@api_router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    return await find_job(job_id, current_user)
+
+@api_router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await find_job(job_id, current_user)
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    if job["kind"] != "export":
+        return job["result"]
+    
+    download = await job_files.open_download_stream(job_id)
+    
+    async def chunks():
+        while chunk := await download.readchunk():
+            yield chunk
+    
+    return StreamingResponse(chunks(), media_type=job["result"]["media_type"], headers={
+        "Content-Disposition": f'attachment; filename="{job["result"]["filename"]}"',
+        "Content-Length": str(job["result"]["size"])
+    })
+
+@api_router.delete("/jobs/{job_id}", response_model=Job)
+async def cancel_job(job_id: str, current_user: User = Depends(get_current_user)):
+    await find_job(job_id, current_user)
+    # Queued jobs are cancelled outright; running ones stop at their next progress update
+    result = await db.jobs.update_one(
+        {"id": job_id, "status": "queued"},
+        {"$set": {"status": "cancelled", "cancel_requested": True, "finished_at": datetime.utcnow()}}
+    )
+    if not result.modified_count:
+        result = await db.jobs.update_one({"id": job_id, "status": "running"}, {"$set": {"cancel_requested": True}})
+        if not result.modified_count:
+            raise HTTPException(status_code=409, detail="Job has already finished")
+        job_runner.cancel_local(job_id)
+    return await find_job(job_id, current_user)
+
+# Analytics Routes
+@api_router.get("/analytics/overview")
+async def get_analytics_overview(request: Request, current_user: User = Depends(get_current_user)):
+    query = {}
+    if current_user.role == "municipality" and current_user.city:
+        query["city"] = current_user.city
+    
+    async def build():
+        # Read the per-city summary rows instead of scanning the inventory
+        rows = await analytics_primary_db.infrastructure_stats.find({**query, "count": {"$gt": 0}}).to_list(None)
+        
+        distributions = {field: {} for field in STATS_FIELDS}
+        for row in rows:
+            counts = distributions[row["field"]]
+            counts[row["value"]] = counts.get(row["value"], 0) + row["count"]
+        
+        return {
+            "type_distribution": distributions["type"],
+            "status_distribution": distributions["status"],
+            "condition_distribution": distributions["condition"]
+        }, {}
+    
+    return await cached_json_response(request, {"route": "analytics", "query": query}, build)
+
+@api_router.get("/analytics/trends")
+async def get_trends(
+    request: Request,
+    start: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    granularity: str = "day",
+    city: Optional[str] = None,
+    type: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    # Changes per period from the daily or monthly rollups; both ends are rounded down to their period
+    if granularity not in HISTORY_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(HISTORY_GRANULARITIES)}")
+    if current_user.role == "municipality" and current_user.city:
+        city = current_user.city
+    
+    start, to = [
+        history_period(value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value, granularity) if value else None
+        for value in (start, to)
+    ]
+    end = to or history_period(datetime.utcnow(), granularity)
+    if start is None:
+        start = end
+        for _ in range(TRENDS_DEFAULT_PERIODS[granularity] - 1):
+            start = history_period(start - timedelta(days=1), granularity)
+    if start > end:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    
+    periods = [start]
+    while periods[-1] < end:
+        if len(periods) >= TRENDS_MAX_PERIODS:
+            raise HTTPException(status_code=400, detail=f"At most {TRENDS_MAX_PERIODS} periods per request")
+        periods.append(next_history_period(periods[-1], granularity))
+    
+    query = {"granularity": granularity, "period": {"$gte": start, "$lte": end}}
+    if city:
+        query["city"] = city
+    if type:
+        query["type"] = type
+    
+    async def build():
+        series = {
+            period: {"period": period, "events": 0, "inserted": 0, "updated": 0, "deleted": 0, "maintained": 0, "status": Counter(), "condition": Counter()}
+            for period in periods
+        }
+        async for row in analytics_primary_db.infrastructure_rollups.find(query, {"_id": 0}):
+            point = series[row["period"]]
+            for field in ("events", "inserted", "updated", "deleted", "maintained"):
+                point[field] += row.get(field, 0)
+            for field in ("status", "condition"):
+                point[field].update(row.get(field, {}))
+        for point in series.values():
+            for field in ("status", "condition"):
+                point[field] = {value: count for value, count in point[field].items() if count}
+        return {"granularity": granularity, "from": start, "to": end, "series": list(series.values())}, {}
+    
+    # The query holds the resolved range, so an open-ended request moves on to a new entry each period
+    scope = {"route": "trends", "query": query}
+    return await cached_json_response(request, scope, build)
+
+@api_router.get("/analytics/priority")
+async def get_repair_priority(
+    request: Request,
+    k: int = Query(PRIORITY_DEFAULT_K, ge=1, le=PRIORITY_MAX_K),
+    city: Optional[str] = None,
+    type: Optional[str] = None,
+    weights: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    # Top-k assets to repair per city under the scoring model
+    if current_user.role == "municipality" and current_user.city:
+        city = current_user.city
+    model = {**PRIORITY_MODEL, "weights": parse_priority_weights(weights)}
+    
+    async def build():
+        columns = await priority_columns.get()
+        with timed_stage("scoring"):
+            scores, factors = priority_scores(columns, model, datetime.utcnow())
+            city_codes, cities = columns["city"]
+            mask = np.ones(len(scores), dtype=bool)
+            for field, value in (("city", city), ("type", type)):
+                if value:
+                    codes, labels = columns[field]
+                    mask &= codes == (labels.index(value) if value in labels else -2)
+            ranked = top_k_per_city(scores, city_codes, mask, k)
+        
+        codes = {field: columns[field] for field in ("district", "type", "status", "condition")}
+        def label(field, row):
+            code = codes[field][0][row]
+            return codes[field][1][code] if code >= 0 else None
+        
+        return {
+            "weights": model["weights"],
+            "total": int(mask.sum()),
+            "cities": {
+                cities[code] if code >= 0 else None: [
+                    {
+                        "id": columns["id"][row],
+                        "name": columns["name"][row],
+                        **{field: label(field, row) for field in codes},
+                        "score": round(float(scores[row]), 4),
+                        "factors": {name: round(float(values[row]), 4) for name, values in factors.items()},
+                    }
+                    for row in rows
+                ]
+                for code, rows in ranked.items()
+            }
+        }, {}
+    
+    scope = {"route": "priority", "k": k, "city": city, "type": type, "weights": model["weights"]}
+    return await cached_json_response(request, scope, build)
+
+@api_router.get("/analytics/heatmap")
+async def get_damage_heatmap(
+    request: Request,
+    resolution: float = Query(HEATMAP_DEFAULT_RESOLUTION, ge=HEATMAP_MIN_RESOLUTION, le=10),
+    bbox: Optional[str] = None,
+    city: Optional[str] = None,
+    district: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    # Density of damaged, needs-repair and critical assets per grid cell of `resolution` degrees
+    if current_user.role == "municipality" and current_user.city:
+        city = current_user.city
+    bounds = parse_bbox(bbox) if bbox else None
+    
+    async def build():
+        return damage_index.grid(resolution, bounds, city, district), {}
+    
+    scope = {"route": "heatmap", "resolution": resolution, "bbox": bounds, "city": city, "district": district}
+    return await cached_json_response(request, scope, build)
+
+# Cities endpoint
+@api_router.get("/cities")
+async def get_cities(request: Request):
+    async def build():
+        return await db.infrastructure.distinct("city"), {}
+    
+    return await cached_json_response(request, {"route": "cities"}, build)
+
+# Cache statistics
+@api_router.get("/system/cache-stats")
+async def get_cache_stats(current_user: User = Depends(get_current_user)):
+    return {name: cache.stats() for name, cache in caches.items()}
+
+@api_router.get("/system/bcrypt-stats")
+async def get_bcrypt_stats(current_user: User = Depends(get_current_user)):
+    return {
+        "workers": BCRYPT_WORKERS,
+        "rounds": BCRYPT_ROUNDS,
+        "queue_depth": bcrypt_queue_depth(),
+        **bcrypt_stats
+    }
+
+# Test endpoint
+@api_router.get("/")
+async def root():
+    return {"message": "Syrian Infrastructure GIS API"}
+
+# Include the router in the main app
+app.include_router(api_router)
+
+# Request metrics
+# Plain ASGI middleware so streaming responses are measured without being buffered
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        method = scope["method"]
+        response = {"status": 500, "size": 0, "event_stream": False}
+        
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["event_stream"] = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream") for name, value in message["headers"]
+                )
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+        
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        requests_in_progress.labels(method).inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            seconds = time.perf_counter() - started
+            requests_in_progress.labels(method).dec()
+            request_timings.reset(token)
+            
+            # Label by route template so path parameters don't explode the series count
+            route = scope.get("route")
+            route_path = route.path if route else "unmatched"
+            request_latency.labels(method, route_path, str(response["status"])).observe(seconds)
+            response_size.labels(method, route_path).observe(response["size"])
+            if SLOW_REQUEST_SECONDS and seconds >= SLOW_REQUEST_SECONDS and not response["event_stream"]:
+                task = asyncio.create_task(log_slow_request(f"{method} {route_path}", seconds, timings))
+                slow_request_tasks.add(task)
+                task.add_done_callback(slow_request_tasks.discard)
+
+slow_request_tasks = set()
+
+def explain_summary(explain: dict) -> str:
+    # Aggregations nest the find-level plan under their $cursor stage
+    for stage in explain.get("stages", []):
+        if "$cursor" in stage:
+            explain = stage["$cursor"]
+            break
+    stages = plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+    stats = explain.get("executionStats", {})
+    return (
+        f"plan {' <- '.join(stages) or 'unknown'}, {stats.get('totalKeysExamined', '?')} keys and "
+        f"{stats.get('totalDocsExamined', '?')} docs examined, {stats.get('nReturned', '?')} returned"
+    )
+
+async def log_slow_request(route: str, seconds: float, timings: RequestTimings):
+    stages = ", ".join(f"{name} {value:.3f}s" for name, value in timings.stages.items()) or "none"
+    message = f"Slow request {route}: {seconds:.3f}s total, mongo {timings.mongo_seconds:.3f}s over {timings.mongo_commands} commands, stages: {stages}"
+    if timings.slowest_command:
+        command_seconds, database, command = timings.slowest_command
+        command = {key: value for key, value in command.items() if not key.startswith("$") and key != "lsid"}
+        try:
+            explain = await client[database].command({"explain": command, "verbosity": "executionStats"})
+            message += f"; slowest query {next(iter(command))} {command_seconds:.3f}s: {explain_summary(explain)}"
+        except OperationFailure as e:
+            message += f"; could not explain slowest query: {e}"
+    logger.warning(message)
+
+# Pool exhaustion and an unreachable server surface as a measured 503 rather than a stalled request
+@app.exception_handler(WaitQueueTimeoutError)
+async def mongo_pool_exhausted(request: Request, exc: WaitQueueTimeoutError):
+    return ORJSONResponse(status_code=503, content={"detail": "Database is busy, retry shortly"}, headers={"Retry-After": "1"})
+
+@app.exception_handler(ServerSelectionTimeoutError)
+async def mongo_unavailable(request: Request, exc: ServerSelectionTimeoutError):
+    return ORJSONResponse(status_code=503, content={"detail": "Database is unavailable"}, headers={"Retry-After": "5"})
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# Rate limiting and admission control
+# Buckets are per process; another backend only needs the same async take() to share them between processes
+class MemoryRateLimitBackend:
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+    
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        # Returns 0 when the request may proceed, otherwise the seconds until enough tokens refill
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return wait
+
+RATE_LIMIT_BACKENDS = {"memory": MemoryRateLimitBackend}
+if RATE_LIMIT_BACKEND not in RATE_LIMIT_BACKENDS:
+    raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND {RATE_LIMIT_BACKEND!r}")
+rate_limit_backend = RATE_LIMIT_BACKENDS[RATE_LIMIT_BACKEND]()
+
+def rate_limit_cost(method: str, path: str, query_string: bytes = b"") -> str:
+    if method == "GET" and RATE_LIMIT_PAGED_ROUTES.match(path):
+        params = parse_qs(query_string.decode('latin-1'))
+        stream = params.get("stream", [""])[-1].lower() in ("1", "true", "yes", "on")
+        limit = params.get("limit", [""])[-1]
+        small_page = limit.isdigit() and int(limit) <= RATE_LIMIT_CHEAP_PAGE_SIZE
+        return "cheap" if small_page and not stream else "expensive"
+    for methods, pattern, cost in RATE_LIMIT_ROUTES:
+        if method in methods and pattern.match(path):
+            return cost
+    return "cheap"
+
+def rate_limit_identity(scope, cost: str) -> tuple:
+    # Decodes the bearer token without touching the database; the route still authenticates it properly.
+    # The role is only known once get_current_user has cached the user, until then the base budget applies
+    client_address = scope["client"][0] if scope.get("client") else "unknown"
+    if cost == "auth":
+        return f"ip:{client_address}", 1.0
+    authorization = next((value for name, value in scope["headers"] if name == b"authorization"), b"")
+    scheme, _, token = authorization.decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return f"ip:{client_address}", 1.0
+    try:
+        user_id = jwt.decode(token, SECRET_KEY, algorithms=["HS256"]).get("user_id")
+    except jwt.InvalidTokenError:
+        return f"ip:{client_address}", 1.0
+    user = user_cache.peek(user_id)
+    return f"user:{user_id}", RATE_LIMIT_ROLE_MULTIPLIERS.get(user.role, 1.0) if user else 1.0
+
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.in_flight = 0
+        self.expensive_in_flight = 0
+    
+    async def __call__(self, scope, receive, send):
+        if not RATE_LIMIT_ENABLED or scope["type"] != "http" or scope["method"] == "OPTIONS" or not scope["path"].startswith("/api/"):
+            return await self.app(scope, receive, send)
+        
+        method, path = scope["method"], scope["path"]
+        cost = rate_limit_cost(method, path, scope.get("query_string", b""))
+        long_lived = path in RATE_LIMIT_LONG_LIVED_PATHS
+        
+        # Shed load before any work is done for the request, cheapest check first
+        if not long_lived and (
+            self.in_flight >= MAX_CONCURRENT_REQUESTS
+            or (cost == "expensive" and self.expensive_in_flight >= MAX_CONCURRENT_EXPENSIVE_REQUESTS)
+        ):
+            requests_rejected.labels("overloaded", cost).inc()
+            return await self.reject(scope, receive, send, 1, "Server is busy, retry shortly")
+        
+        key, multiplier = rate_limit_identity(scope, cost)
+        rate, burst = RATE_LIMITS[cost]
+        wait = await rate_limit_backend.take(f"{cost}:{key}", rate * multiplier, burst * multiplier)
+        if wait:
+            requests_rejected.labels("rate_limited", cost).inc()
+            return await self.reject(scope, receive, send, wait, "Too many requests")
+        
+        if long_lived:
+            return await self.app(scope, receive, send)
+        
+        expensive = cost == "expensive"
+        self.in_flight += 1
+        self.expensive_in_flight += expensive
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+            self.expensive_in_flight -= expensive
+    
+    @staticmethod
+    async def reject(scope, receive, send, retry_after: float, detail: str):
+        response = ORJSONResponse(status_code=429, content={"detail": detail}, headers={"Retry-After": str(math.ceil(retry_after))})
+        await response(scope, receive, send)
+
+# Added before CORS so rejections still carry CORS headers, and inside the metrics middleware so they are counted
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(
+    CORSMiddleware,
+    allow_credentials=True,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
+)
+app.add_middleware(MetricsMiddleware)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+# Index management
+# Every query shape used by the routes above must be served by one of these
+INDEX_SPECS = {
+    "users": [
+        {"keys": [("email", 1)], "unique": True},
+        {"keys": [("id", 1)], "unique": True},
+    ],
+    "infrastructure": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("city", 1), ("type", 1), ("status", 1)]},
+        {"keys": [("type", 1), ("status", 1)]},
+        {"keys": INFRASTRUCTURE_SORT},
+        {"keys": [("city", 1)] + INFRASTRUCTURE_SORT},
+        {"keys": [("location", "2dsphere")]},
+    ],
+    "infrastructure_stats": [
+        {"keys": [("city", 1), ("field", 1), ("value", 1)], "unique": True},
+    ],
+    "infrastructure_rollups": [
+        {"keys": [("granularity", 1), ("city", 1), ("type", 1), ("period", 1)], "unique": True},
+        {"keys": [("granularity", 1), ("period", 1)]},
+    ],
+    "infrastructure_links": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("from_id", 1), ("to_id", 1)], "unique": True},
+        {"keys": [("to_id", 1)]},
+        {"keys": [("city", 1), ("type", 1)]},
+    ],
+    "jobs": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("status", 1), ("created_at", 1)]},
+        {"keys": [("user_id", 1), ("created_at", -1)]},
+        {"keys": [("finished_at", 1)]},
+    ],
+    "job_slots": [
+        {"keys": [("role", 1), ("slot", 1)], "unique": True},
+        {"keys": [("job_id", 1)]},
+    ],
+    "infrastructure_tombstones": [
+        {"keys": [("deleted_at", 1)], "expireAfterSeconds": TOMBSTONE_RETENTION_DAYS * 86400},
+        {"keys": [("city", 1), ("deleted_at", 1)]},
+    ],
+}
+
+# (route, collection, filter, sort) for each hot path, checked with explain() at startup
+QUERY_SHAPES = [
+    ("POST /auth/login", "users", {"email": "probe@example.com"}, None),
+    ("auth", "users", {"id": "probe"}, None),
+    ("PUT/DELETE /infrastructure/{id}", "infrastructure", {"id": "probe"}, None),
+    ("GET /infrastructure", "infrastructure", {}, INFRASTRUCTURE_SORT),
+    ("GET /infrastructure?city", "infrastructure", {"city": "probe"}, INFRASTRUCTURE_SORT),
+    ("GET /infrastructure/geojson?city&type&status", "infrastructure", {"city": "probe", "type": "probe", "status": "probe"}, None),
+    ("GET /infrastructure/geojson?type&status", "infrastructure", {"type": "probe", "status": "probe"}, None),
+    ("GET /infrastructure?bbox", "infrastructure", bbox_filter([36.2, 33.4, 36.4, 33.6]), None),
+    ("GET /analytics/overview", "infrastructure_stats", {"city": "probe", "count": {"$gt": 0}}, None),
+    ("GET /infrastructure/changes?city", "infrastructure", {"city": "probe", "updated_at": {"$gt": datetime(2000, 1, 1)}}, INFRASTRUCTURE_SORT),
+    ("GET /analytics/trends", "infrastructure_rollups", {"granularity": "month", "period": {"$gte": datetime(2000, 1, 1)}}, None),
+    ("GET /analytics/trends?city", "infrastructure_rollups", {"granularity": "month", "city": "probe", "period": {"$gte": datetime(2000, 1, 1)}}, None),
+    ("GET /infrastructure/changes (deletes)", "infrastructure_tombstones", {"city": "probe", "deleted_at": {"$gt": datetime(2000, 1, 1)}}, [("deleted_at", 1)]),
+]
+EXPLAIN_QUERY_SHAPES = os.environ.get('EXPLAIN_QUERY_SHAPES', 'true').lower() == 'true'
+
+def index_name(keys: List[tuple]) -> str:
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+async def ensure_indexes():
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        for spec in specs:
+            keys = list(spec["keys"])
+            name = index_name(keys)
+            options = {option: spec[option] for option in ("unique", "expireAfterSeconds") if option in spec}
+            
+            # Drop indexes whose name, key pattern or options clash with the declaration
+            for existing_name, info in list(existing.items()):
+                same_keys = [tuple(key) for key in info["key"]] == keys
+                same_options = info.get("unique", False) == options.get("unique", False) and \
+                    info.get("expireAfterSeconds") == options.get("expireAfterSeconds")
+                if (existing_name == name and not (same_keys and same_options)) or \
+                        (same_keys and existing_name != name):
+                    logger.info("Dropping index %s.%s to match its declaration", collection_name, existing_name)
+                    await collection.drop_index(existing_name)
+                    del existing[existing_name]
+            
+            try:
+                await collection.create_index(keys, name=name, **options)
+            except OperationFailure as e:
+                logger.error("Could not create index %s.%s: %s", collection_name, name, e)
+        
+        declared = {index_name(list(spec["keys"])) for spec in specs} | {"_id_"}
+        for existing_name in set(existing) - declared:
+            logger.info("Index %s.%s is not declared in INDEX_SPECS", collection_name, existing_name)
+
+def plan_stages(plan: dict) -> List[str]:
+    stages = []
+    if "queryPlan" in plan:
+        plan = plan["queryPlan"]
+    stage = plan.get("stage")
+    if stage:
+        stages.append(f"{stage}({plan['indexName']})" if "indexName" in plan else stage)
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            stages += plan_stages(child)
+    return stages
+
+async def explain_query_shapes():
+    for route, collection_name, query, sort in QUERY_SHAPES:
+        cursor = db[collection_name].find(query).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            explain = await cursor.explain()
+        except OperationFailure as e:
+            logger.warning("Could not explain %s: %s", route, e)
+            continue
+        stages = plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        level = logging.WARNING if "COLLSCAN" in stages else logging.INFO
+        logger.log(level, "Query plan for %s: %s", route, " <- ".join(stages) or "unknown")
+
+@app.on_event("startup")
+async def prepare_database():
+    await ensure_history_collection()
+    await ensure_indexes()
+    await migrate_locations()
+    await rebuild_infrastructure_stats()
+    await damage_index.rebuild()
+    await network_graphs.load()
+    await search_index.rebuild()
+    if EXPLAIN_QUERY_SHAPES:
+        await explain_query_shapes()
+    await warm_up_pools()
+    change_feed.start()
+    await job_runner.start()
+
+async def warm_up_pools():
+    # Concurrent pings check out separate connections, so the first requests don't pay for handshakes
+    for database, options in ((db, MONGO_POOL_OPTIONS), (analytics_db, MONGO_ANALYTICS_POOL_OPTIONS)):
+        await asyncio.gather(*(database.command("ping", read_preference=database.read_preference) for _ in range(options["minPoolSize"])))
+
+async def migrate_locations():
+    # One-time backfill of the GeoJSON location for documents stored before it existed
+    result = await db.infrastructure.update_many(
+        {
+            "location": {"$exists": False},
+            "coordinates.0": {"$gte": -180, "$lte": 180},
+            "coordinates.1": {"$gte": -90, "$lte": 90}
+        },
+        [{"$set": {"location": {"type": "Point", "coordinates": "$coordinates"}}}]
+    )
+    if result.modified_count:
+        logger.info("Backfilled location for %d infrastructure items", result.modified_count)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await change_feed.stop()
+    await job_runner.stop()
+    client.close()
+    analytics_client.close()
+    bcrypt_executor.shutdown(wait=False)
\ No newline at end of file
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# Local load and latency benchmark for the NetwordGIS backend.
+#
+# Starts backend/server.py in-process against a local mongod (or mongomock-motor with --mock),
+# seeds synthetic infrastructure with the generator from backend_test.py, drives concurrent
+# requests at the main endpoints and writes p50/p95/p99 latency and throughput to a JSON file
+# so runs can be compared between commits:
+#
+#   python backend_benchmark.py --items 5000 --concurrency 50
+#   python backend_benchmark.py --mock --compare benchmark_results/<previous>.json
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+import numpy as np
+import uvicorn
+from pymongo import MongoClient
+
+from backend_test import CITIES, USERS, generate_infrastructure_item
+
+ROOT_DIR = Path(__file__).parent
+RESULTS_DIR = ROOT_DIR / "benchmark_results"
+
+# Scenario name -> share of --requests it runs; bulk posts a whole batch per request
+SCENARIOS = {
+    "login": 0.25,
+    "list": 1.0,
+    "geojson": 1.0,
+    "analytics": 1.0,
+    "priority": 1.0,
+    "bulk": 0.1,
+}
+BULK_BATCH_SIZE = 100
+SEED_BATCH_SIZE = 1000
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="NetwordGIS backend load benchmark")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="networdgis_benchmark", help="Dropped and re-seeded on every run")
+    parser.add_argument("--mock", action="store_true", help="Use mongomock-motor instead of a mongod")
+    parser.add_argument("--items", type=int, default=2000, help="Synthetic assets to seed")
+    parser.add_argument("--requests", type=int, default=400, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of " + ",".join(SCENARIOS))
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Results file (default: benchmark_results/<timestamp>-<commit>.json)")
+    parser.add_argument("--compare", help="Previous results file to diff against")
+    return parser.parse_args()
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def load_server(args):
+    # server.py reads its configuration at import time
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db_name
+    os.environ.setdefault("EXPLAIN_QUERY_SHAPES", "false")
+    # The load comes from one client address and user, which the rate limiter would throttle
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    sys.path.insert(0, str(ROOT_DIR / "backend"))
+    import server
+
+    if args.mock:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--mock needs mongomock-motor: pip install mongomock-motor")
+        server.client = AsyncMongoMockClient()
+        server.db = server.analytics_db = server.analytics_primary_db = server.client[args.db_name]
+        # mongomock has no change streams; the feed stays on this process's writes
+        server.change_feed.start = lambda: None
+        # nor time-series collections; history goes to a plain collection
+        async def plain_history_collection():
+            pass
+        server.ensure_history_collection = plain_history_collection
+    return server
+
+class ServerThread(threading.Thread):
+    def __init__(self, app, port):
+        super().__init__(daemon=True)
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+
+    def run(self):
+        self.server.run()
+
+    def wait_started(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self.is_alive() or time.monotonic() > deadline:
+                sys.exit("Server failed to start")
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.join(timeout=10)
+
+def feature_collection(items):
+    return json.dumps({"type": "FeatureCollection", "features": items}, ensure_ascii=False).encode("utf-8")
+
+async def authenticate(client, role):
+    user = USERS[role]
+    await client.post("/api/auth/register", json=user)
+    response = await client.post("/api/auth/login", json={"email": user["email"], "password": user["password"]})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+async def seed(client, headers, count):
+    inserted = 0
+    for start in range(0, count, SEED_BATCH_SIZE):
+        items = [generate_infrastructure_item(random.choice(CITIES)) for _ in range(min(SEED_BATCH_SIZE, count - start))]
+        response = await client.post("/api/infrastructure/bulk", headers=headers, files={"file": ("seed.geojson", feature_collection(items))})
+        response.raise_for_status()
+        inserted += response.json()["inserted"]
+    return inserted
+
+def scenario_request(name, headers):
+    # Returns a coroutine factory for one request of the scenario
+    if name == "login":
+        user = USERS["ministry"]
+        return lambda client: client.post("/api/auth/login", json={"email": user["email"], "password": user["password"]})
+    if name == "list":
+        return lambda client: client.get("/api/infrastructure", headers=headers, params={"limit": 100, "city": random.choice(CITIES)})
+    if name == "geojson":
+        return lambda client: client.get("/api/infrastructure/geojson", headers=headers)
+    if name == "analytics":
+        return lambda client: client.get("/api/analytics/overview", headers=headers)
+    if name == "priority":
+        return lambda client: client.get("/api/analytics/priority", headers=headers, params={"k": 50})
+    if name == "bulk":
+        def bulk(client):
+            items = [generate_infrastructure_item(random.choice(CITIES)) for _ in range(BULK_BATCH_SIZE)]
+            return client.post("/api/infrastructure/bulk", headers=headers, files={"file": ("bulk.geojson", feature_collection(items))})
+        return bulk
+    raise ValueError(f"Unknown scenario: {name}")
+
+async def run_scenario(client, name, headers, total, concurrency):
+    make_request = scenario_request(name, headers)
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                response = await make_request(client)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, errors, elapsed)
+
+def summarize(latencies, errors, elapsed):
+    ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "requests": len(ms),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ms) / elapsed, 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+def drop_benchmark_database(args):
+    # The server's Motor client belongs to the server thread's loop, so use a separate sync client
+    if not args.mock:
+        with MongoClient(args.mongo_url) as client:
+            client.drop_database(args.db_name)
+
+async def run_benchmark(args):
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=120) as client:
+        headers = await authenticate(client, "ministry")
+        await authenticate(client, "municipality")
+
+        started = time.perf_counter()
+        inserted = await seed(client, headers, args.items)
+        print(f"Seeded {inserted} items in {time.perf_counter() - started:.1f}s")
+
+        for name in args.scenarios.split(","):
+            total = max(1, int(args.requests * SCENARIOS[name]))
+            results[name] = await run_scenario(client, name, headers, total, args.concurrency)
+            print_scenario(name, results[name])
+    return results
+
+def print_scenario(name, stats):
+    print(f"{name:<10} {stats['requests']:>6} req  {stats['throughput_rps']:>8.1f} req/s  "
+          f"p50 {stats['p50_ms']:>8.1f}ms  p95 {stats['p95_ms']:>8.1f}ms  p99 {stats['p99_ms']:>8.1f}ms  errors {stats['errors']}")
+
+def print_comparison(results, previous_path):
+    previous = json.loads(Path(previous_path).read_text())
+    print(f"\nCompared with {previous_path} (commit {previous.get('commit')}):")
+    for name, stats in results.items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            change = (stats[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            changes.append(f"{key} {before[key]} -> {stats[key]} ({change:+.1f}%)")
+        print(f"{name:<10} " + ", ".join(changes))
+
+def main():
+    args = parse_args()
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    random.seed(args.seed)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    drop_benchmark_database(args)
+    server = load_server(args)
+    server_thread = ServerThread(server.app, args.port)
+    server_thread.start()
+    server_thread.wait_started()
+
+    # Requests are served by the server thread's event loop; the load runs on its own loop
+    try:
+        results = asyncio.run(run_benchmark(args))
+    finally:
+        server_thread.stop()
+        drop_benchmark_database(args)
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.utcnow().isoformat(),
+        "backend": "mongomock" if args.mock else "mongod",
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "scenarios": results,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.utcnow():%Y%m%dT%H%M%S}-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        print_comparison(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 import requests
 import json
+import gzip
 import time
 from datetime import datetime, timedelta
 import random
+import threading
 
 # Base URL from frontend/.env
 BASE_URL = "https://8a814be7-1247-4171-a328-06f467fd9987.preview.emergentagent.com/api"
@@ -83,6 +85,11 @@ def get_infrastructure(token, params=None):
     response = requests.get(f"{BASE_URL}/infrastructure", headers=headers, params=params)
     return response
 
+def bulk_import_infrastructure(token, filename, content):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = requests.post(f"{BASE_URL}/infrastructure/bulk", headers=headers, files={"file": (filename, content)})
+    return response
+
 def update_infrastructure(token, item_id, data):
     headers = {"Authorization": f"Bearer {token}"}
     response = requests.put(f"{BASE_URL}/infrastructure/{item_id}", headers=headers, json=data)
@@ -98,6 +105,11 @@ def get_geojson(token, params=None):
     response = requests.get(f"{BASE_URL}/infrastructure/geojson", headers=headers, params=params)
     return response
 
+def get_clusters(token, params=None):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = requests.get(f"{BASE_URL}/infrastructure/clusters", headers=headers, params=params)
+    return response
+
 def get_analytics(token):
     headers = {"Authorization": f"Bearer {token}"}
     response = requests.get(f"{BASE_URL}/analytics/overview", headers=headers)
@@ -255,6 +267,148 @@ def test_infrastructure_management(tokens):
     
     return all_passed, created_items
 
+def test_bulk_import(tokens):
+    print_test_header("Bulk Import")
+    
+    all_passed = True
+    
+    if "municipality" in tokens:
+        token = tokens["municipality"]
+        city = USERS["municipality"]["city"]
+        
+        # NDJSON with one row outside the user's city and one malformed row
+        rows = [generate_infrastructure_item(city) for _ in range(20)]
+        rows.append(generate_infrastructure_item("حلب"))
+        content = "\n".join(json.dumps(row, ensure_ascii=False) for row in rows) + "\nnot json\n"
+        response = bulk_import_infrastructure(token, "assets.ndjson", content.encode("utf-8"))
+        
+        success = response.status_code == 200
+        if success:
+            report = response.json()
+            success = report["inserted"] == 20 and report["failed"] == 2 and sorted(e["row"] for e in report["errors"]) == [21, 22]
+        all_passed = all_passed and success
+        print_test_result("Bulk import NDJSON as municipality", success, f"Status: {response.status_code}, Report: {response.text[:200]}")
+        
+        # GeoJSON FeatureCollection
+        features = []
+        for _ in range(10):
+            item = generate_infrastructure_item(city)
+            features.append({"type": "Feature", "geometry": {"type": "Point", "coordinates": item.pop("coordinates")}, "properties": item})
+        content = json.dumps({"type": "FeatureCollection", "features": features}, ensure_ascii=False)
+        response = bulk_import_infrastructure(token, "assets.geojson", content.encode("utf-8"))
+        success = response.status_code == 200 and response.json()["inserted"] == 10
+        all_passed = all_passed and success
+        print_test_result("Bulk import GeoJSON as municipality", success, f"Status: {response.status_code}")
+        
+        # A file truncated mid-feature still imports the features before the break
+        content = json.dumps({"type": "FeatureCollection", "features": features[:5]}, ensure_ascii=False)[:-2] + ', {"type": "Feature", "geo'
+        response = bulk_import_infrastructure(token, "assets.geojson", content.encode("utf-8"))
+        report = response.json() if response.status_code == 200 else {}
+        success = report.get("received") == 5 and report.get("inserted") == 5 and [e["row"] for e in report.get("errors", [])] == [None]
+        all_passed = all_passed and success
+        print_test_result("Bulk import truncated GeoJSON", success, f"Status: {response.status_code}, Report: {response.text[:200]}")
+        
+        # Unknown format
+        response = bulk_import_infrastructure(token, "assets.txt", b"x")
+        success = response.status_code == 400
+        all_passed = all_passed and success
+        print_test_result("Bulk import unknown format", success, f"Status: {response.status_code}")
+    
+    return all_passed
+
+def test_export(tokens):
+    print_test_header("Streaming Export")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        headers = {"Authorization": f"Bearer {tokens['ministry']}"}
+        total = len(get_infrastructure(tokens["ministry"], {"limit": 5000}).json())
+        
+        response = requests.get(f"{BASE_URL}/infrastructure/export", headers=headers, params={"format": "geojson"})
+        success = response.status_code == 200 and len(response.json()["features"]) == total
+        all_passed = all_passed and success
+        print_test_result("Export GeoJSON", success, f"Status: {response.status_code}, Expected: {total}")
+        
+        # The gzip option produces a .gz download, not a Content-Encoding
+        response = requests.get(f"{BASE_URL}/infrastructure/export", headers=headers, params={"format": "ndjson", "gzip": "true"})
+        lines = gzip.decompress(response.content).splitlines() if response.status_code == 200 else []
+        success = response.status_code == 200 and len(lines) == total
+        all_passed = all_passed and success
+        print_test_result("Export gzipped NDJSON", success, f"Status: {response.status_code}, Lines: {len(lines)}")
+        
+        response = requests.get(f"{BASE_URL}/infrastructure/export", headers=headers, params={"format": "csv"})
+        success = response.status_code == 200 and len(response.text.strip().splitlines()) >= 1
+        all_passed = all_passed and success
+        print_test_result("Export CSV", success, f"Status: {response.status_code}")
+        
+        response = requests.get(f"{BASE_URL}/infrastructure/export", headers=headers, params={"format": "geoparquet"})
+        success = response.status_code == 200 and response.content[:4] == b"PAR1"
+        all_passed = all_passed and success
+        print_test_result("Export GeoParquet", success, f"Status: {response.status_code}")
+        
+        response = requests.get(f"{BASE_URL}/infrastructure/export", headers=headers, params={"format": "xls"})
+        success = response.status_code == 400
+        all_passed = all_passed and success
+        print_test_result("Export unknown format", success, f"Status: {response.status_code}")
+    
+    return all_passed
+
+def test_pagination(tokens):
+    print_test_header("Cursor Pagination and NDJSON Streaming")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        token = tokens["ministry"]
+        
+        # Walk every page with a small page size and check for duplicates
+        seen_ids = []
+        cursor = None
+        pages = 0
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = get_infrastructure(token, params)
+            if response.status_code != 200:
+                break
+            seen_ids.extend(item["id"] for item in response.json())
+            pages += 1
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        
+        success = response.status_code == 200 and len(seen_ids) == len(set(seen_ids))
+        all_passed = all_passed and success
+        print_test_result("Follow pagination cursor", success, f"Pages: {pages}, Items: {len(seen_ids)}")
+        
+        # Streaming mode returns the same items, one JSON document per line
+        response = get_infrastructure(token, {"stream": "true"})
+        lines = [line for line in response.text.splitlines() if line.strip()]
+        success = response.status_code == 200 and len(lines) == len(seen_ids)
+        all_passed = all_passed and success
+        print_test_result("Stream infrastructure as NDJSON", success, f"Status: {response.status_code}, Lines: {len(lines)}")
+        
+        # Sparse field sets always carry id and updated_at for the cursor
+        response = get_infrastructure(token, {"fields": "coordinates,type", "limit": 5})
+        success = response.status_code == 200 and all(set(item) == {"id", "updated_at", "coordinates", "type"} for item in response.json())
+        all_passed = all_passed and success
+        print_test_result("Sparse field selection", success, f"Status: {response.status_code}")
+        
+        response = get_infrastructure(token, {"fields": "password"})
+        success = response.status_code == 400
+        all_passed = all_passed and success
+        print_test_result("Reject unknown field", success, f"Status: {response.status_code}")
+        
+        # Invalid cursor
+        response = get_infrastructure(token, {"cursor": "not-a-cursor"})
+        success = response.status_code == 400
+        all_passed = all_passed and success
+        print_test_result("Reject invalid cursor", success, f"Status: {response.status_code}")
+    
+    return all_passed
+
 def test_role_based_access(tokens, created_items):
     print_test_header("Role-based Access Control")
     
@@ -318,6 +472,46 @@ def test_role_based_access(tokens, created_items):
     
     return all_passed
 
+def get_cache_stats(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    return requests.get(f"{BASE_URL}/system/cache-stats", headers=headers).json()["users"]
+
+def test_user_administration(tokens, user_ids):
+    print_test_header("User Administration")
+    
+    all_passed = True
+    
+    if "ministry" in tokens and "municipality" in tokens and "municipality" in user_ids:
+        ministry_headers = {"Authorization": f"Bearer {tokens['ministry']}"}
+        token = tokens["municipality"]
+        user_id = user_ids["municipality"]
+        other_city = next(city for city in CITIES if city != USERS["municipality"]["city"])
+        
+        # The next request after a city change is scoped to the new city, through a fresh cache entry
+        before = get_cache_stats(token)
+        response = requests.put(f"{BASE_URL}/users/{user_id}", headers=ministry_headers, json={"city": other_city})
+        items = get_infrastructure(token).json()
+        after = get_cache_stats(token)
+        success = response.status_code == 200 and all(item["city"] == other_city for item in items) and \
+            after["misses"] > before["misses"] and after["hits"] > before["hits"]
+        all_passed = all_passed and success
+        print_test_result("City change applies to the next request", success, f"Status: {response.status_code}, Cache: {before} -> {after}")
+        
+        # A role change is seen the same way: as a ministry user it can change its own role back
+        response = requests.put(f"{BASE_URL}/users/{user_id}", headers=ministry_headers, json={"role": "ministry"})
+        restored = requests.put(f"{BASE_URL}/users/{user_id}", headers={"Authorization": f"Bearer {token}"},
+                                json={"role": "municipality", "city": USERS["municipality"]["city"]})
+        success = response.status_code == 200 and restored.status_code == 200 and restored.json()["role"] == "municipality"
+        all_passed = all_passed and success
+        print_test_result("Role change applies to the next request", success, f"Status: {response.status_code}, {restored.status_code}")
+        
+        response = requests.put(f"{BASE_URL}/users/{user_id}", headers=ministry_headers, json={"role": "admin"})
+        success = response.status_code == 400
+        all_passed = all_passed and success
+        print_test_result("Unknown role rejected", success, f"Status: {response.status_code}")
+    
+    return all_passed
+
 def test_geojson_api(tokens):
     print_test_header("GeoJSON API for Map Visualization")
     
@@ -369,6 +563,113 @@ def test_geojson_api(tokens):
     
     return all_passed
 
+def test_spatial_queries(tokens):
+    print_test_header("Spatial Bounding-Box and Radius Queries")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        token = tokens["ministry"]
+        item_data = generate_infrastructure_item(random.choice(CITIES))
+        item_data["coordinates"] = [36.2765, 33.5138]  # Damascus
+        response = create_infrastructure(token, item_data)
+        if response.status_code != 200:
+            return print_test_result("Create item for spatial queries", False, f"Status: {response.status_code}")
+        item_id = response.json()["id"]
+        
+        # Bounding box around Damascus includes the item
+        response = get_infrastructure(token, {"bbox": "36.2,33.4,36.4,33.6", "limit": 5000})
+        success = response.status_code == 200 and item_id in [item["id"] for item in response.json()]
+        all_passed = all_passed and success
+        print_test_result("Bounding box query", success, f"Status: {response.status_code}")
+        
+        # Bounding box over Aleppo excludes it
+        response = get_geojson(token, {"bbox": "37.0,36.1,37.3,36.3"})
+        success = response.status_code == 200 and item_id not in [f["properties"]["id"] for f in response.json()["features"]]
+        all_passed = all_passed and success
+        print_test_result("Bounding box GeoJSON query", success, f"Status: {response.status_code}")
+        
+        # Wide bounding box whose southern edge sits just below the item
+        response = get_infrastructure(token, {"bbox": "30.3,33.51,42.3,34.5", "limit": 5000})
+        success = response.status_code == 200 and item_id in [item["id"] for item in response.json()]
+        all_passed = all_passed and success
+        print_test_result("Wide bounding box keeps items near its southern edge", success, f"Status: {response.status_code}")
+        
+        # Radius query around the item
+        response = get_infrastructure(token, {"near": "36.2766,33.5139", "radius_m": 500, "limit": 5000})
+        success = response.status_code == 200 and item_id in [item["id"] for item in response.json()]
+        all_passed = all_passed and success
+        print_test_result("Radius query", success, f"Status: {response.status_code}")
+        
+        # Malformed bbox
+        response = get_infrastructure(token, {"bbox": "1,2,3"})
+        success = response.status_code == 400
+        all_passed = all_passed and success
+        print_test_result("Reject malformed bbox", success, f"Status: {response.status_code}")
+        
+        delete_infrastructure(token, item_id)
+    
+    return all_passed
+
+def test_clusters_api(tokens):
+    print_test_header("Marker Clustering API")
+    
+    all_passed = True
+    
+    for role, token in tokens.items():
+        total = len(get_infrastructure(token, {"limit": 5000}).json())
+        
+        # Clusters at national zoom must account for every visible asset
+        response = get_clusters(token, {"zoom": 6})
+        success = response.status_code == 200 and sum(c["count"] for c in response.json()["clusters"]) == total
+        all_passed = all_passed and success
+        print_test_result(f"Get clusters as {role}", success, 
+                         f"Status: {response.status_code}, Assets: {total}")
+    
+    # Zoom is required
+    if "ministry" in tokens:
+        response = get_clusters(tokens["ministry"])
+        success = response.status_code == 422
+        all_passed = all_passed and success
+        print_test_result("Clusters without zoom", success, f"Status: {response.status_code}")
+    
+    return all_passed
+
+def test_vector_tiles(tokens):
+    print_test_header("Vector Tile API")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        headers = {"Authorization": f"Bearer {tokens['ministry']}"}
+        
+        # Zoom 6 tile covering Damascus
+        response = requests.get(f"{BASE_URL}/tiles/6/38/25.mvt", headers=headers)
+        success = response.status_code == 200 and response.headers.get("Content-Type") == "application/vnd.mapbox-vector-tile"
+        all_passed = all_passed and success
+        print_test_result("Get vector tile", success, f"Status: {response.status_code}, Bytes: {len(response.content)}")
+        
+        # Unchanged tile revalidates with 304
+        etag = response.headers.get("ETag")
+        response = requests.get(f"{BASE_URL}/tiles/6/38/25.mvt", headers={**headers, "If-None-Match": etag})
+        success = etag is not None and response.status_code == 304
+        all_passed = all_passed and success
+        print_test_result("Conditional tile request", success, f"Status: {response.status_code}")
+        
+        # Zoomed-out tile is bounded by a coordinate range instead of a geodesic bbox
+        response = requests.get(f"{BASE_URL}/tiles/2/2/1.mvt", headers=headers)
+        success = response.status_code == 200 and len(response.content) > 0
+        all_passed = all_passed and success
+        print_test_result("Get low-zoom vector tile", success, f"Status: {response.status_code}, Bytes: {len(response.content)}")
+        
+        # Tile outside the zoom level's grid
+        response = requests.get(f"{BASE_URL}/tiles/2/9/0.mvt", headers=headers)
+        success = response.status_code == 404
+        all_passed = all_passed and success
+        print_test_result("Out-of-range tile", success, f"Status: {response.status_code}")
+    
+    return all_passed
+
 def test_analytics_api(tokens):
     print_test_header("Analytics Dashboard API")
     
@@ -398,6 +699,470 @@ def test_analytics_api(tokens):
         
         print_test_result(f"Get analytics as {role}", success, message)
     
+    # Summary rows stay in step with the inventory across a create, an update and a delete
+    if "ministry" in tokens:
+        token = tokens["ministry"]
+        headers = {"Authorization": f"Bearer {token}"}
+        created = {}
+        steps = [
+            ("create", lambda: created.update(create_infrastructure(token, {**generate_infrastructure_item(random.choice(CITIES)), "status": "operational"}).json())),
+            ("update", lambda: update_infrastructure(token, created["id"], {"status": "damaged"})),
+            ("delete", lambda: delete_infrastructure(token, created["id"])),
+        ]
+        for step, action in steps:
+            action()
+            summary = get_analytics(token).json().get("status_distribution", {})
+            response = requests.get(f"{BASE_URL}/infrastructure", headers=headers, params={"stream": "true", "fields": "status"})
+            live = {}
+            for line in response.text.splitlines():
+                status = json.loads(line)["status"]
+                live[status] = live.get(status, 0) + 1
+            success = summary == live
+            all_passed = all_passed and success
+            print_test_result(f"Overview matches live count after {step}", success, f"Overview: {summary}, Live: {live}")
+    
+    return all_passed
+
+def test_conditional_requests(tokens):
+    print_test_header("ETag and Conditional GET")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        headers = {"Authorization": f"Bearer {tokens['ministry']}"}
+        for path in ["/infrastructure", "/infrastructure/geojson", "/analytics/overview", "/cities"]:
+            response = requests.get(f"{BASE_URL}{path}", headers=headers)
+            etag = response.headers.get("ETag")
+            revalidated = requests.get(f"{BASE_URL}{path}", headers={**headers, "If-None-Match": etag or ""})
+            success = response.status_code == 200 and etag is not None and revalidated.status_code == 304
+            all_passed = all_passed and success
+            print_test_result(f"Conditional GET {path}", success, f"Status: {revalidated.status_code}")
+        
+        # A write changes the collection version and therefore the ETag
+        response = requests.get(f"{BASE_URL}/analytics/overview", headers=headers)
+        etag = response.headers.get("ETag")
+        created = create_infrastructure(tokens["ministry"], generate_infrastructure_item(random.choice(CITIES)))
+        response = requests.get(f"{BASE_URL}/analytics/overview", headers={**headers, "If-None-Match": etag or ""})
+        success = created.status_code == 200 and response.status_code == 200
+        all_passed = all_passed and success
+        print_test_result("ETag changes after write", success, f"Status: {response.status_code}")
+        if created.status_code == 200:
+            delete_infrastructure(tokens["ministry"], created.json()["id"])
+    
+    return all_passed
+
+def test_delta_sync(tokens):
+    print_test_header("Delta Sync")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        token = tokens["ministry"]
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        # Full sync to obtain a high-water mark
+        response = requests.get(f"{BASE_URL}/infrastructure/changes", headers=headers, params={"limit": 5000})
+        success = response.status_code == 200 and response.json()["next_cursor"] is None
+        all_passed = all_passed and success
+        print_test_result("Initial sync", success, f"Status: {response.status_code}")
+        if not success:
+            return all_passed
+        high_water_mark = response.json()["high_water_mark"]
+        
+        # One update and one delete after the mark
+        created = create_infrastructure(token, generate_infrastructure_item(random.choice(CITIES))).json()
+        update_infrastructure(token, created["id"], {"status": "damaged"})
+        deleted = create_infrastructure(token, generate_infrastructure_item(random.choice(CITIES))).json()
+        delete_infrastructure(token, deleted["id"])
+        
+        response = requests.get(f"{BASE_URL}/infrastructure/changes", headers=headers, params={"since": high_water_mark})
+        data = response.json()
+        success = response.status_code == 200 and \
+            created["id"] in [item["id"] for item in data["upserts"]] and \
+            deleted["id"] in [item["id"] for item in data["deletes"]] and \
+            deleted["id"] not in [item["id"] for item in data["upserts"]]
+        all_passed = all_passed and success
+        print_test_result("Incremental sync", success, f"Upserts: {len(data.get('upserts', []))}, Deletes: {len(data.get('deletes', []))}")
+        
+        # The mark trails recent writes, so a sync from it sends them again rather than risk skipping one
+        response = requests.get(f"{BASE_URL}/infrastructure/changes", headers=headers, params={"since": data.get("high_water_mark")})
+        success = response.status_code == 200 and created["id"] in [item["id"] for item in response.json()["upserts"]]
+        all_passed = all_passed and success
+        print_test_result("High-water mark trails recent writes", success, f"Status: {response.status_code}")
+        
+        delete_infrastructure(token, created["id"])
+    
+    return all_passed
+
+def read_change_stream(token, params, events, ready, timeout=20):
+    # Collects (event, data) pairs from the SSE feed until the connection closes or times out
+    try:
+        with requests.get(f"{BASE_URL}/infrastructure/stream", params={**params, "token": token}, stream=True, timeout=timeout) as response:
+            ready.set()
+            name = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    name = line[len("event: "):]
+                elif line.startswith("data: ") and name:
+                    events.append((name, json.loads(line[len("data: "):])))
+    except requests.exceptions.RequestException:
+        pass
+    finally:
+        ready.set()
+
+def wait_for_event(events, predicate, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if any(predicate(name, data) for name, data in events):
+            return True
+        time.sleep(0.2)
+    return False
+
+def test_change_stream(tokens):
+    print_test_header("Change Stream")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        token = tokens["ministry"]
+        city = random.choice(CITIES)
+        events = []
+        ready = threading.Event()
+        threading.Thread(target=read_change_stream, args=(token, {"city": city, "status": "operational"}, events, ready), daemon=True).start()
+        ready.wait(10)
+        time.sleep(0.5)
+        
+        created = create_infrastructure(token, {**generate_infrastructure_item(city), "status": "operational"}).json()
+        success = wait_for_event(events, lambda name, data: name == "insert" and data["id"] == created["id"])
+        all_passed = all_passed and success
+        print_test_result("Insert delivered", success, f"Events: {len(events)}")
+        
+        # Updating the item out of the feed's status filter must tell the feed to drop it
+        update_infrastructure(token, created["id"], {"status": "damaged"})
+        success = wait_for_event(events, lambda name, data: name == "delete" and data["id"] == created["id"])
+        all_passed = all_passed and success
+        print_test_result("Update out of filter delivered as delete", success, f"Events: {len(events)}")
+        
+        delete_infrastructure(token, created["id"])
+    
+    return all_passed
+
+def test_batch_operations(tokens):
+    print_test_header("Batch Update and Delete")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        token = tokens["ministry"]
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        ids = [create_infrastructure(token, generate_infrastructure_item(random.choice(CITIES))).json()["id"] for _ in range(3)]
+        
+        # One status change applied to every item in the filter
+        response = requests.patch(f"{BASE_URL}/infrastructure", headers=headers, json={"filter": {"ids": ids}, "update": {"status": "damaged"}})
+        success = response.status_code == 200 and response.json()["matched"] == len(ids)
+        all_passed = all_passed and success
+        print_test_result("Batch update by filter", success, f"Status: {response.status_code}, Response: {response.text[:100]}")
+        
+        # Explicit per-item updates
+        items = [{"id": ids[0], "status": "operational"}, {"id": ids[1], "condition": "poor"}]
+        response = requests.patch(f"{BASE_URL}/infrastructure", headers=headers, json={"items": items})
+        success = response.status_code == 200 and response.json()["matched"] == 2
+        all_passed = all_passed and success
+        print_test_result("Batch update by items", success, f"Status: {response.status_code}, Response: {response.text[:100]}")
+        
+        # An empty filter must not touch the whole collection
+        response = requests.patch(f"{BASE_URL}/infrastructure", headers=headers, json={"filter": {}, "update": {"status": "damaged"}})
+        success = response.status_code == 400
+        all_passed = all_passed and success
+        print_test_result("Empty filter rejected", success, f"Status: {response.status_code}")
+        
+        response = requests.delete(f"{BASE_URL}/infrastructure", headers=headers, json={"ids": ids})
+        success = response.status_code == 200 and response.json()["deleted"] == len(ids)
+        all_passed = all_passed and success
+        print_test_result("Batch delete", success, f"Status: {response.status_code}, Response: {response.text[:100]}")
+    
+    return all_passed
+
+def test_damage_heatmap(tokens):
+    print_test_header("Damage Heatmap")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        token = tokens["ministry"]
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = requests.get(f"{BASE_URL}/analytics/heatmap", headers=headers, params={"resolution": 0.5})
+        before = response.json().get("total", 0) if response.status_code == 200 else None
+        
+        # A new damaged asset must show up in the grid without a rebuild
+        item = {**generate_infrastructure_item(random.choice(CITIES)), "status": "damaged"}
+        created = create_infrastructure(token, item).json()
+        response = requests.get(f"{BASE_URL}/analytics/heatmap", headers=headers, params={"resolution": 0.5})
+        data = response.json()
+        success = response.status_code == 200 and before is not None and data["total"] == before + 1 and \
+            all(len(cell) == 3 for cell in data["cells"])
+        all_passed = all_passed and success
+        print_test_result("Heatmap counts damaged assets", success, f"Status: {response.status_code}, Total: {data.get('total')}, Size: {len(response.content)} bytes")
+        
+        response = requests.get(f"{BASE_URL}/analytics/heatmap", headers=headers, params={"resolution": 0.001, "bbox": "35,32,43,38"})
+        success = response.status_code == 400
+        all_passed = all_passed and success
+        print_test_result("Oversized grid rejected", success, f"Status: {response.status_code}")
+        
+        delete_infrastructure(token, created["id"])
+    
+    return all_passed
+
+def test_trends(tokens):
+    print_test_header("Maintenance Trends")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        token = tokens["ministry"]
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = requests.get(f"{BASE_URL}/analytics/trends", headers=headers)
+        before = response.json()["series"][-1] if response.status_code == 200 else None
+        
+        # An insert and a status change land in today's rollup
+        item = {**generate_infrastructure_item(random.choice(CITIES)), "status": "operational"}
+        created = create_infrastructure(token, item).json()
+        update_infrastructure(token, created["id"], {"status": "damaged"})
+        response = requests.get(f"{BASE_URL}/analytics/trends", headers=headers)
+        data = response.json()
+        today = data["series"][-1] if response.status_code == 200 else {}
+        success = before is not None and len(data["series"]) == 30 and \
+            today.get("inserted") == before["inserted"] + 1 and today.get("updated") == before["updated"] + 1 and \
+            today["status"].get("damaged", 0) == before["status"].get("damaged", 0) + 1
+        all_passed = all_passed and success
+        print_test_result("Daily rollup records changes", success, f"Status: {response.status_code}, Today: {today.get('events')} events")
+        
+        response = requests.get(f"{BASE_URL}/analytics/trends", headers=headers, params={"granularity": "month", "from": "2024-01-01"})
+        success = response.status_code == 200 and response.json()["series"][0]["period"].startswith("2024-01-01")
+        all_passed = all_passed and success
+        print_test_result("Monthly trends", success, f"Status: {response.status_code}")
+        
+        response = requests.get(f"{BASE_URL}/analytics/trends", headers=headers, params={"granularity": "week"})
+        success = response.status_code == 400
+        all_passed = all_passed and success
+        print_test_result("Unknown granularity rejected", success, f"Status: {response.status_code}")
+        
+        delete_infrastructure(token, created["id"])
+    
+    return all_passed
+
+def test_repair_priority(tokens):
+    print_test_header("Repair Priority")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        token = tokens["ministry"]
+        headers = {"Authorization": f"Bearer {token}"}
+        city = random.choice(CITIES)
+        
+        # A critical, damaged, decades-old water asset must rank first in its city
+        item = {
+            **generate_infrastructure_item(city), "type": "water", "status": "damaged", "condition": "critical",
+            "installation_date": (datetime.utcnow() - timedelta(days=365 * 60)).isoformat()
+        }
+        created = create_infrastructure(token, item).json()
+        response = requests.get(f"{BASE_URL}/analytics/priority", headers=headers, params={"city": city, "k": 5})
+        ranked = response.json()["cities"].get(city, []) if response.status_code == 200 else []
+        success = len(ranked) > 0 and ranked[0]["score"] == 1.0 and \
+            all(a["score"] >= b["score"] for a, b in zip(ranked, ranked[1:]))
+        all_passed = all_passed and success
+        print_test_result("Top-k ranking per city", success, f"Status: {response.status_code}, Ranked: {len(ranked)}")
+        
+        # Missing dates score as unknown rather than as brand new
+        undated = {**generate_infrastructure_item(city), "type": "priority_probe"}
+        undated.pop("installation_date")
+        undated = create_infrastructure(token, undated).json()
+        response = requests.get(f"{BASE_URL}/analytics/priority", headers=headers, params={"city": city, "type": "priority_probe"})
+        ranked = response.json()["cities"].get(city, []) if response.status_code == 200 else []
+        factors = ranked[0]["factors"] if ranked else {}
+        success = factors.get("age") == 0.5 and factors.get("maintenance") == 0.5
+        all_passed = all_passed and success
+        print_test_result("Missing dates score as unknown", success, f"Status: {response.status_code}, Factors: {factors}")
+        delete_infrastructure(token, undated["id"])
+        
+        response = requests.get(f"{BASE_URL}/analytics/priority", headers=headers, params={"weights": "rust:1"})
+        success = response.status_code == 400
+        all_passed = all_passed and success
+        print_test_result("Unknown factor rejected", success, f"Status: {response.status_code}")
+        
+        delete_infrastructure(token, created["id"])
+    
+    return all_passed
+
+def test_network_topology(tokens):
+    print_test_header("Network Topology")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        token = tokens["ministry"]
+        headers = {"Authorization": f"Bearer {token}"}
+        city = random.choice(CITIES)
+        
+        # source -> pump -> tap, plus a second feed into the tap
+        ids = [create_infrastructure(token, {**generate_infrastructure_item(city), "type": "water", "status": "operational"}).json()["id"] for _ in range(4)]
+        source, pump, tap, backup = ids
+        for from_id, to_id in [(source, pump), (pump, tap)]:
+            response = requests.post(f"{BASE_URL}/network/links", headers=headers, json={"from_id": from_id, "to_id": to_id})
+            success = response.status_code == 200 and response.json()["length_m"] > 0
+            all_passed = all_passed and success
+            print_test_result("Create link", success, f"Status: {response.status_code}")
+        
+        response = requests.get(f"{BASE_URL}/network/downstream/{source}", headers=headers)
+        success = response.status_code == 200 and set(response.json()["affected"]) == {pump, tap}
+        all_passed = all_passed and success
+        print_test_result("Downstream of source", success, f"Response: {response.text[:100]}")
+        
+        # A redundant feed keeps the tap in service when the pump fails
+        requests.post(f"{BASE_URL}/network/links", headers=headers, json={"from_id": backup, "to_id": tap})
+        response = requests.get(f"{BASE_URL}/network/downstream/{pump}", headers=headers)
+        success = response.status_code == 200 and response.json()["affected"] == []
+        all_passed = all_passed and success
+        print_test_result("Redundant feed", success, f"Response: {response.text[:100]}")
+        
+        response = requests.get(f"{BASE_URL}/network/route", headers=headers, params={"from_id": source, "to_id": backup})
+        success = response.status_code == 200 and response.json()["path"] == [source, pump, tap, backup]
+        all_passed = all_passed and success
+        print_test_result("Shortest route", success, f"Response: {response.text[:100]}")
+        
+        for item_id in ids:
+            delete_infrastructure(token, item_id)
+        response = requests.get(f"{BASE_URL}/network/links", headers=headers, params={"city": city, "type": "water"})
+        success = response.status_code == 200 and not [link for link in response.json() if link["from_id"] in ids]
+        all_passed = all_passed and success
+        print_test_result("Links removed with their assets", success, f"Status: {response.status_code}")
+    
+    return all_passed
+
+def test_search(tokens):
+    print_test_header("Arabic Search")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        token = tokens["ministry"]
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        marker = f"اختبار{random.randint(10000, 99999)}"
+        item = {**generate_infrastructure_item(random.choice(CITIES)), "name": f"محطة مياه {marker}", "type": "water"}
+        created = create_infrastructure(token, item).json()
+        
+        # Hamza on the alef, ta marbuta and an attached article are folded away
+        for query in [marker, f"ال{marker}", f"محطه {marker}", marker[:6]]:
+            response = requests.get(f"{BASE_URL}/infrastructure/search", headers=headers, params={"q": query, "type": "water"})
+            success = response.status_code == 200 and created["id"] in [hit["id"] for hit in response.json()["items"]]
+            all_passed = all_passed and success
+            print_test_result(f"Search '{query}'", success, f"Status: {response.status_code}, Total: {response.json().get('total') if response.status_code == 200 else None}")
+        
+        response = requests.get(f"{BASE_URL}/infrastructure/search", headers=headers, params={"q": marker, "type": "roads"})
+        success = response.status_code == 200 and response.json()["total"] == 0
+        all_passed = all_passed and success
+        print_test_result("Search respects filters", success, f"Status: {response.status_code}")
+        
+        delete_infrastructure(token, created["id"])
+        response = requests.get(f"{BASE_URL}/infrastructure/search", headers=headers, params={"q": marker})
+        success = response.status_code == 200 and response.json()["total"] == 0
+        all_passed = all_passed and success
+        print_test_result("Deleted items leave the index", success, f"Status: {response.status_code}")
+    
+    return all_passed
+
+def wait_for_job(headers, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = requests.get(f"{BASE_URL}/jobs/{job_id}", headers=headers).json()
+        if job.get("status") not in ("queued", "running"):
+            return job
+        time.sleep(1)
+    return job
+
+def test_jobs(tokens):
+    print_test_header("Background Jobs")
+    
+    all_passed = True
+    
+    if "ministry" in tokens:
+        token = tokens["ministry"]
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = requests.post(f"{BASE_URL}/jobs/export", headers=headers, params={"format": "ndjson", "gzip": "true"})
+        success = response.status_code == 202 and response.json()["status"] == "queued"
+        all_passed = all_passed and success
+        print_test_result("Submit export job", success, f"Status: {response.status_code}")
+        
+        if success:
+            job = wait_for_job(headers, response.json()["id"])
+            response = requests.get(f"{BASE_URL}/jobs/{job['id']}/result", headers=headers)
+            success = job["status"] == "succeeded" and response.status_code == 200 and \
+                len(gzip.decompress(response.content)) > 0
+            all_passed = all_passed and success
+            print_test_result("Download export result", success, f"Job: {job['status']}, Size: {len(response.content)} bytes")
+        
+        items = [generate_infrastructure_item(random.choice(CITIES)) for _ in range(3)]
+        content = json.dumps({"type": "FeatureCollection", "features": items}, ensure_ascii=False).encode("utf-8")
+        response = requests.post(f"{BASE_URL}/jobs/import", headers=headers, files={"file": ("items.geojson", content)})
+        success = response.status_code == 202
+        if success:
+            job = wait_for_job(headers, response.json()["id"])
+            success = job["status"] == "succeeded" and job["result"]["inserted"] == len(items)
+        all_passed = all_passed and success
+        print_test_result("Import job", success, f"Status: {response.status_code}")
+        
+        # Finished jobs cannot be cancelled
+        response = requests.delete(f"{BASE_URL}/jobs/{response.json()['id']}", headers=headers)
+        success = response.status_code == 409
+        all_passed = all_passed and success
+        print_test_result("Cancel finished job rejected", success, f"Status: {response.status_code}")
+    
+    if "municipality" in tokens:
+        headers = {"Authorization": f"Bearer {tokens['municipality']}"}
+        response = requests.post(f"{BASE_URL}/jobs/rebuild-stats", headers=headers)
+        success = response.status_code == 403
+        all_passed = all_passed and success
+        print_test_result("Rebuild restricted to ministry", success, f"Status: {response.status_code}")
+    
+    return all_passed
+
+def test_rate_limiting(tokens):
+    print_test_header("Rate Limiting")
+    
+    all_passed = True
+    
+    if "municipality" in tokens:
+        headers = {"Authorization": f"Bearer {tokens['municipality']}"}
+        
+        # Expensive routes have a small per-user burst; hammering one must end in 429 with a Retry-After
+        response = None
+        for _ in range(200):
+            response = requests.get(f"{BASE_URL}/analytics/heatmap", headers=headers)
+            if response.status_code == 429:
+                break
+        retry_after = response.headers.get("Retry-After", "")
+        success = response.status_code == 429 and retry_after.isdigit()
+        all_passed = all_passed and success
+        print_test_result("Expensive route rate limited", success, f"Status: {response.status_code}, Retry-After: {retry_after}")
+        
+        # Full-inventory reads draw on the same exhausted budget
+        response = requests.get(f"{BASE_URL}/infrastructure", headers=headers, params={"stream": "true"})
+        success = response.status_code == 429
+        all_passed = all_passed and success
+        print_test_result("Inventory stream rate limited as expensive", success, f"Status: {response.status_code}")
+        
+        # Cheap routes keep their own budget
+        response = requests.get(f"{BASE_URL}/infrastructure", headers=headers, params={"limit": 1})
+        success = response.status_code == 200
+        all_passed = all_passed and success
+        print_test_result("Cheap route still served", success, f"Status: {response.status_code}")
+    
     return all_passed
 
 def test_cities_api():
@@ -432,18 +1197,91 @@ def run_all_tests():
         infra_success, created_items = test_infrastructure_management(tokens)
         test_results["Infrastructure Data Management"] = infra_success
         
+        # Test bulk import
+        bulk_success = test_bulk_import(tokens)
+        test_results["Bulk Import"] = bulk_success
+        
+        # Test export
+        export_success = test_export(tokens)
+        test_results["Streaming Export"] = export_success
+        
+        # Test pagination
+        pagination_success = test_pagination(tokens)
+        test_results["Cursor Pagination"] = pagination_success
+        
         # Test role-based access
         rbac_success = test_role_based_access(tokens, created_items)
         test_results["Role-based Access Control"] = rbac_success
         
+        # Test user administration
+        users_success = test_user_administration(tokens, user_ids)
+        test_results["User Administration"] = users_success
+        
         # Test GeoJSON API
         geojson_success = test_geojson_api(tokens)
         test_results["GeoJSON API"] = geojson_success
         
+        # Test spatial queries
+        spatial_success = test_spatial_queries(tokens)
+        test_results["Spatial Queries"] = spatial_success
+        
+        # Test clusters API
+        clusters_success = test_clusters_api(tokens)
+        test_results["Clusters API"] = clusters_success
+        
+        # Test vector tiles
+        tiles_success = test_vector_tiles(tokens)
+        test_results["Vector Tiles"] = tiles_success
+        
         # Test analytics API
         analytics_success = test_analytics_api(tokens)
         test_results["Analytics Dashboard API"] = analytics_success
     
+    if tokens:
+        # Test conditional requests
+        conditional_success = test_conditional_requests(tokens)
+        test_results["Conditional Requests"] = conditional_success
+        
+        # Test delta sync
+        sync_success = test_delta_sync(tokens)
+        test_results["Delta Sync"] = sync_success
+        
+        # Test change stream
+        stream_success = test_change_stream(tokens)
+        test_results["Change Stream"] = stream_success
+        
+        # Test batch update and delete
+        batch_success = test_batch_operations(tokens)
+        test_results["Batch Operations"] = batch_success
+        
+        # Test damage heatmap
+        heatmap_success = test_damage_heatmap(tokens)
+        test_results["Damage Heatmap"] = heatmap_success
+        
+        # Test maintenance trends
+        trends_success = test_trends(tokens)
+        test_results["Maintenance Trends"] = trends_success
+        
+        # Test repair priority
+        priority_success = test_repair_priority(tokens)
+        test_results["Repair Priority"] = priority_success
+        
+        # Test network topology
+        network_success = test_network_topology(tokens)
+        test_results["Network Topology"] = network_success
+        
+        # Test search
+        search_success = test_search(tokens)
+        test_results["Arabic Search"] = search_success
+        
+        # Test background jobs
+        jobs_success = test_jobs(tokens)
+        test_results["Background Jobs"] = jobs_success
+        
+        # Test rate limiting last, it uses up the municipality user's expensive budget
+        rate_limit_success = test_rate_limiting(tokens)
+        test_results["Rate Limiting"] = rate_limit_success
+    
     # Test cities API
     cities_success = test_cities_api()
     test_results["Cities API"] = cities_success
@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useContext, createContext } from 'react';
+import React, { useState, useEffect, useContext, createContext, useRef } from 'react';
 import { MapContainer, TileLayer, Marker, Popup, useMap } from 'react-leaflet';
 import L from 'leaflet';
 import axios from 'axios';
@@ -471,6 +471,28 @@ const MapClickHandler = ({ onMapClick }) => {
   return null;
 };
 
+// Map Component reporting the visible bounding box
+const MapBoundsHandler = ({ onBoundsChange }) => {
+  const map = useMap();
+  
+  useEffect(() => {
+    const handleMove = () => {
+      const bounds = map.getBounds();
+      const bbox = [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()];
+      onBoundsChange(bbox.map((value) => value.toFixed(5)).join(','));
+    };
+    
+    handleMove();
+    map.on('moveend', handleMove);
+    
+    return () => {
+      map.off('moveend', handleMove);
+    };
+  }, [map, onBoundsChange]);
+  
+  return null;
+};
+
 // Main App Component
 const App = () => {
   const [user, setUser] = useState(null);
@@ -483,6 +505,8 @@ const App = () => {
   const [clickedCoordinates, setClickedCoordinates] = useState(null);
   const [analytics, setAnalytics] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [mapBounds, setMapBounds] = useState(null);
+  const infrastructureRequest = useRef(null);
 
   // Initialize axios with token
   useEffect(() => {
@@ -494,7 +518,7 @@ const App = () => {
 
   const fetchUserData = async () => {
     try {
-      const response = await axios.get(`${API}/infrastructure`);
+      const response = await axios.get(`${API}/infrastructure`, { params: { limit: 1 } });
       // If successful, user is authenticated
       fetchInfrastructure();
       fetchAnalytics();
@@ -504,16 +528,45 @@ const App = () => {
     }
   };
 
-  const fetchInfrastructure = async () => {
+  // Only load the assets inside the visible part of the map
+  useEffect(() => {
+    if (token && mapBounds) {
+      fetchInfrastructure(mapBounds);
+    }
+  }, [mapBounds]);
+
+  const fetchInfrastructure = async (bbox = mapBounds) => {
+    // A newer viewport supersedes any load still in flight, so a slow older response is never applied
+    if (infrastructureRequest.current) {
+      infrastructureRequest.current.abort();
+    }
+    const controller = new AbortController();
+    infrastructureRequest.current = controller;
     setLoading(true);
     try {
-      const response = await axios.get(`${API}/infrastructure`);
-      setInfrastructureData(response.data);
-      setFilteredData(response.data);
+      // Follow the pagination cursor until the server stops returning one
+      let items = [];
+      let cursor = null;
+      do {
+        const params = bbox ? { bbox } : {};
+        if (cursor) {
+          params.cursor = cursor;
+        }
+        const response = await axios.get(`${API}/infrastructure`, { params, signal: controller.signal });
+        items = items.concat(response.data);
+        cursor = response.headers['x-next-cursor'];
+      } while (cursor);
+      setInfrastructureData(items);
+      setFilteredData(items);
     } catch (error) {
-      console.error('Error fetching infrastructure:', error);
+      if (!axios.isCancel(error)) {
+        console.error('Error fetching infrastructure:', error);
+      }
     } finally {
-      setLoading(false);
+      if (infrastructureRequest.current === controller) {
+        infrastructureRequest.current = null;
+        setLoading(false);
+      }
     }
   };
 
@@ -710,6 +763,7 @@ const App = () => {
                 />
                 
                 <MapClickHandler onMapClick={handleMapClick} />
+                <MapBoundsHandler onBoundsChange={setMapBounds} />
                 
                 {filteredData.map((item) => (
                   <Marker